@@ -13,19 +13,14 @@ from django.template.defaultfilters import filesizeformat
 
 from Artifactorial.models import AuthToken, Artifact, Directory, Share
 
-import datetime
-
 
 class AuthTokenAdmin(admin.ModelAdmin):
     list_display = ("user", "description")
 
 
 class ArtifactAdmin(admin.ModelAdmin):
-    def ttl(self, obj):
-        return obj.created_at + datetime.timedelta(days=obj.directory.ttl)
-
     def size(self, obj):
-        return filesizeformat(obj.path.size)
+        return filesizeformat(obj.size)
 
     def full_path(self, obj):
         return "/" + obj.path.name
@@ -36,7 +31,7 @@ class ArtifactAdmin(admin.ModelAdmin):
         "directory",
         "is_permanent",
         "created_at",
-        "ttl",
+        "expires_at",
     )
     list_filter = ("directory",)
 
@@ -48,9 +43,31 @@ class ArtifactAdmin(admin.ModelAdmin):
 
 class DirectoryAdmin(admin.ModelAdmin):
     def current_size(self, obj):
-        return "%s / %s" % (filesizeformat(obj.size()), filesizeformat(obj.quota))
+        return "%s / %s" % (filesizeformat(obj.used_bytes), filesizeformat(obj.quota))
+
+    def schedule_purge(self, request, queryset):
+        # Deleting large directories in the request would time out
+        count = 0
+        for directory in queryset:
+            directory.schedule_purge()
+            count += 1
+        self.message_user(request, "%d directories scheduled for purge" % count)
+
+    schedule_purge.short_description = "Schedule the purge of the directories"
 
-    list_display = ("path", "user", "group", "is_public", "ttl", "current_size")
+    actions = ["schedule_purge"]
+
+    list_display = (
+        "path",
+        "user",
+        "group",
+        "is_public",
+        "ttl",
+        "artifact_count",
+        "current_size",
+        "is_deleting",
+    )
+    list_filter = ("is_deleting",)
 
 
 class ShareAdmin(admin.ModelAdmin):
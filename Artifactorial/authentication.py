@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+#
+# Copyright 2017-present Linaro Limited
+#
+# Author: Rémi Duraffort <remi.duraffort@linaro.org>
+#
+# SPDX-License-Identifier: MIT
+
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_vary_headers
+
+from Artifactorial.models import AuthToken
+
+import copy
+import hashlib
+import threading
+import time
+
+# In-process cache of the tokens: secret => (user, expiration)
+_lock = threading.Lock()
+_tokens = OrderedDict()
+
+
+def _cache_key(secret):
+    return "artifactorial.token.%s" % hashlib.sha256(secret.encode("utf-8")).hexdigest()
+
+
+def _shared_cache():
+    alias = getattr(settings, "ARTIFACTORIAL_TOKEN_CACHE", None)
+    return None if alias is None else caches[alias]
+
+
+def _load_user(secret):
+    try:
+        return AuthToken.objects.select_related("user").get(secret=secret).user
+    except AuthToken.DoesNotExist:
+        return None
+
+
+def get_user(secret):
+    """
+    Return the owner of the token, or None if the token does not exist.
+
+    The tokens are looked up in an in-process LRU, then in the shared cache
+    (if configured) and finally in the database.
+    """
+    ttl = getattr(settings, "ARTIFACTORIAL_TOKEN_CACHE_TTL", 60)
+    if ttl <= 0:
+        return _load_user(secret)
+
+    now = time.monotonic()
+    with _lock:
+        entry = _tokens.get(secret)
+        if entry is not None:
+            if entry[1] > now:
+                _tokens.move_to_end(secret)
+                return copy.copy(entry[0])
+            del _tokens[secret]
+
+    cache = _shared_cache()
+    user = None if cache is None else cache.get(_cache_key(secret))
+    if user is None:
+        user = _load_user(secret)
+        if user is None:
+            return None
+        if cache is not None:
+            cache.set(_cache_key(secret), user, ttl)
+
+    size = getattr(settings, "ARTIFACTORIAL_TOKEN_CACHE_SIZE", 1024)
+    with _lock:
+        _tokens[secret] = (user, now + ttl)
+        _tokens.move_to_end(secret)
+        while len(_tokens) > size:
+            _tokens.popitem(last=False)
+    return copy.copy(user)
+
+
+def invalidate(secret):
+    """Remove the token from the caches"""
+    with _lock:
+        _tokens.pop(secret, None)
+    cache = _shared_cache()
+    if cache is not None:
+        cache.delete(_cache_key(secret))
+
+
+def clear():
+    """Empty the in-process cache"""
+    with _lock:
+        _tokens.clear()
+
+
+class TokenAuthenticationMiddleware(object):
+    """
+    Authenticate the requests with an "Authorization: Token <secret>" header.
+    Should be installed after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        header = request.META.get("HTTP_AUTHORIZATION", "")
+        if header.startswith("Token "):
+            user = get_user(header[len("Token ") :].strip())
+            if user is not None:
+                request.user = user
+
+        response = self.get_response(request)
+        patch_vary_headers(response, ("Authorization",))
+        return response
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+#
+# Copyright 2017-present Linaro Limited
+#
+# Author: Rémi Duraffort <remi.duraffort@linaro.org>
+#
+# SPDX-License-Identifier: MIT
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, urlquote
+
+from Artifactorial.models import guess_content_type
+
+import binascii
+import os
+import re
+
+BACKENDS = ["django", "nginx", "apache"]
+
+CHUNK_SIZE = 64 * 1024
+# Above this number of ranges, the Range header is ignored
+MAX_RANGES = 32
+
+RANGE_RE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+def get_backend():
+    backend = getattr(settings, "ARTIFACTORIAL_DOWNLOAD_BACKEND", "django")
+    if backend not in BACKENDS:
+        raise ImproperlyConfigured(
+            "ARTIFACTORIAL_DOWNLOAD_BACKEND should be one of %s" % ", ".join(BACKENDS)
+        )
+    return backend
+
+
+def get_content_type(artifact):
+    if artifact.content_type:
+        return artifact.content_type
+    return guess_content_type(artifact.path.name)
+
+
+def get_validators(artifact):
+    """
+    Return the validators of the artifact.
+
+    The strong ETag is the stored SHA-256 or, when not available, is built
+    from the size and the modification time.
+
+    :return: a tuple (etag, last_modified, size)
+    """
+    if artifact.size is None or artifact.stored_at is None:
+        # Metadata not yet backfilled
+        stat = os.stat(artifact.path.path)
+        size, last_modified = (stat.st_size, int(stat.st_mtime))
+    else:
+        size = artifact.size
+        last_modified = int(artifact.stored_at.timestamp())
+    if artifact.sha256:
+        etag = '"%s"' % artifact.sha256
+    else:
+        etag = '"%x-%x"' % (size, last_modified)
+    return (etag, last_modified, size)
+
+
+def set_validators(response, artifact, etag, last_modified, max_age=None):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    # Explicit lifetime (signed URLs): can be stored by shared caches
+    if max_age is not None:
+        patch_cache_control(response, public=True, max_age=max_age)
+        return
+    # Only cache the permanent artifacts for long. Private artifacts should
+    # not be stored by shared caches.
+    if artifact.is_permanent:
+        max_age = getattr(
+            settings, "ARTIFACTORIAL_PERMANENT_MAX_AGE", 30 * 24 * 60 * 60
+        )
+    else:
+        max_age = 0
+    if artifact.directory.is_public:
+        patch_cache_control(response, public=True, max_age=max_age)
+    else:
+        patch_cache_control(response, private=True, max_age=max_age)
+
+
+def parse_ranges(header, size):
+    """
+    Parse the Range header value.
+
+    :param header: the Range header value
+    :param size: the size of the file
+    :return: None if the header should be ignored, an empty list if no ranges
+    are satisfiable, or a sorted list of non-overlapping (start, end) tuples
+    (both inclusive).
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+
+    ranges = []
+    for spec in specs.split(","):
+        match = RANGE_RE.match(spec)
+        if match is None:
+            return None
+        first, last = match.groups()
+        if not first:
+            # Suffix range: the last N bytes
+            if not last:
+                return None
+            length = int(last)
+            if length == 0 or size == 0:
+                continue
+            ranges.append((max(size - length, 0), size - 1))
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+            if start >= size:
+                continue
+            ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    # Merge overlapping and adjacent ranges
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(request, etag, last_modified):
+    """
+    Check the If-Range precondition.
+
+    :return: True if the Range header should be honored
+    """
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    # Strong comparison with the ETag
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and date == last_modified
+
+
+def read_range(filename, start, end):
+    with open(filename, "rb") as f_in:
+        f_in.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f_in.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def read_multiple_ranges(filename, parts, boundary):
+    for header, start, end in parts:
+        yield header
+        yield from read_range(filename, start, end)
+        yield b"\r\n"
+    yield b"--%s--\r\n" % boundary
+
+
+def stream(request, artifact, content_type, size, etag, last_modified):
+    ranges = None
+    if "HTTP_RANGE" in request.META and if_range_matches(request, etag, last_modified):
+        ranges = parse_ranges(request.META["HTTP_RANGE"], size)
+
+    if ranges is None:
+        response = FileResponse(
+            open(artifact.path.path, "rb"), content_type=content_type
+        )
+        response["Content-Length"] = size
+
+    elif not ranges:
+        response = HttpResponse(status=416, content_type=content_type)
+        response["Content-Range"] = "bytes */%d" % size
+
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(
+            read_range(artifact.path.path, start, end),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Range"] = "bytes %d-%d/%d" % (start, end, size)
+        response["Content-Length"] = end - start + 1
+
+    else:
+        boundary = binascii.b2a_hex(os.urandom(16))
+        parts = []
+        length = len(b"--%s--\r\n" % boundary)
+        for start, end in ranges:
+            header = (
+                b"--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n"
+                % (boundary, content_type.encode("utf-8"), start, end, size)
+            )
+            parts.append((header, start, end))
+            length += len(header) + end - start + 1 + 2
+        response = StreamingHttpResponse(
+            read_multiple_ranges(artifact.path.path, parts, boundary),
+            status=206,
+            content_type="multipart/byteranges; boundary=%s" % boundary.decode("ascii"),
+        )
+        response["Content-Length"] = length
+
+    return response
+
+
+def serve(request, artifact, max_age=None):
+    """
+    Build the response sending the artifact content to the client.
+
+    With the "nginx" and "apache" backends, Django only returns the headers
+    and the front-end web server sends the file itself, handling the Range
+    requests.
+
+    :param request: the current request
+    :param artifact: the artifact to send
+    :param max_age: how long shared caches can keep the response, when the
+    URL itself grants the access
+    :return: the HTTP response
+    """
+    backend = get_backend()
+    content_type = get_content_type(artifact)
+    etag, last_modified, size = get_validators(artifact)
+
+    # Conditional requests
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, artifact, etag, last_modified, max_age)
+        return response
+
+    if backend == "nginx":
+        # nginx will map this internal location to MEDIA_ROOT
+        location = getattr(
+            settings, "ARTIFACTORIAL_DOWNLOAD_NGINX_LOCATION", "/protected/"
+        )
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = urlquote(
+            "%s/%s" % (location.rstrip("/"), artifact.path.name)
+        )
+    elif backend == "apache":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = artifact.path.path
+    else:
+        response = stream(request, artifact, content_type, size, etag, last_modified)
+
+    response["Accept-Ranges"] = "bytes"
+    set_validators(response, artifact, etag, last_modified, max_age)
+    return response
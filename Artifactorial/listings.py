@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+#
+# Copyright 2017-present Linaro Limited
+#
+# Author: Rémi Duraffort <remi.duraffort@linaro.org>
+#
+# SPDX-License-Identifier: MIT
+
+import json
+import yaml
+
+
+def to_json(directory, folders, files, next_url):
+    """
+    Serialize the listing to JSON, one entry at a time. folders is a list of
+    (name, size) while files can be any iterable of (name, size).
+    """
+    yield '{\n  "directory": %s,\n  "directories": [' % json.dumps(directory)
+    yield ",".join("\n    %s" % json.dumps(name) for (name, _) in folders)
+    yield '\n  ],\n  "files": ['
+    separator = "\n"
+    for name, size in files:
+        yield '%s  {"path": %s, "size": %s}' % (
+            separator,
+            json.dumps(name),
+            json.dumps(size),
+        )
+        separator = ",\n"
+    yield '\n  ],\n  "next": %s\n}\n' % json.dumps(next_url)
+
+
+def to_yaml(directory, folders, files, next_url):
+    """Serialize the listing to YAML, one entry at a time"""
+    yield yaml.safe_dump({"directory": directory}, default_flow_style=False)
+    if folders:
+        yield "directories:\n"
+        yield yaml.safe_dump([name for (name, _) in folders], default_flow_style=False)
+    else:
+        yield "directories: []\n"
+    empty = True
+    for name, size in files:
+        if empty:
+            yield "files:\n"
+            empty = False
+        yield yaml.safe_dump([{"name": name, "size": size}], default_flow_style=False)
+    if empty:
+        yield "files: []\n"
+    yield yaml.safe_dump({"next": next_url}, default_flow_style=False)
+
+
+def to_ndjson(directory, folders, files, next_url):
+    """
+    Serialize the listing to newline delimited JSON: one entry per line. The
+    next page is only given in the Link header.
+    """
+    for name, size in folders:
+        yield json.dumps({"type": "directory", "name": name, "size": size}) + "\n"
+    for name, size in files:
+        yield json.dumps({"type": "file", "name": name, "size": size}) + "\n"
+
+
+def manifest_to_json(directory, artifacts, next_url):
+    """Serialize the recursive listing to JSON, one artifact at a time"""
+    yield '{\n  "directory": %s,\n  "artifacts": [' % json.dumps(directory)
+    separator = "\n"
+    for artifact in artifacts:
+        yield separator + "    " + json.dumps(artifact)
+        separator = ",\n"
+    yield '\n  ],\n  "next": %s\n}\n' % json.dumps(next_url)
+
+
+def manifest_to_yaml(directory, artifacts, next_url):
+    """Serialize the recursive listing to YAML, one artifact at a time"""
+    yield yaml.safe_dump({"directory": directory}, default_flow_style=False)
+    empty = True
+    for artifact in artifacts:
+        if empty:
+            yield "artifacts:\n"
+            empty = False
+        yield yaml.safe_dump([artifact], default_flow_style=False)
+    if empty:
+        yield "artifacts: []\n"
+    yield yaml.safe_dump({"next": next_url}, default_flow_style=False)
+
+
+def manifest_to_ndjson(directory, artifacts, next_url):
+    """Serialize the recursive listing to newline delimited JSON"""
+    for artifact in artifacts:
+        yield json.dumps(artifact) + "\n"
+
+
+SERIALIZERS = {
+    "json": (to_json, "application/json"),
+    "yaml": (to_yaml, "application/yaml"),
+    "ndjson": (to_ndjson, "application/x-ndjson"),
+}
+
+MANIFEST_SERIALIZERS = {
+    "json": (manifest_to_json, "application/json"),
+    "yaml": (manifest_to_yaml, "application/yaml"),
+    "ndjson": (manifest_to_ndjson, "application/x-ndjson"),
+}
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+#
+# Copyright 2017-present Linaro Limited
+#
+# Author: Rémi Duraffort <remi.duraffort@linaro.org>
+#
+# SPDX-License-Identifier: MIT
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from Artifactorial.models import Artifact
+
+
+def compute(artifact):
+    try:
+        return (artifact, artifact.compute_digests(), None)
+    except OSError as exc:
+        return (artifact, None, exc)
+
+
+class Command(BaseCommand):
+    args = None
+    help = "Compute the missing digests"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of files to hash in parallel",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of artifacts to load at once",
+        )
+
+    def handle(self, *args, **kwargs):
+        query = Artifact.objects.filter(Q(md5="") | Q(sha256="")).order_by("pk")
+        last_pk = 0
+        count = 0
+        with ThreadPoolExecutor(max_workers=max(kwargs["workers"], 1)) as pool:
+            while True:
+                batch = list(query.filter(pk__gt=last_pk)[: kwargs["batch_size"]])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                # Hash in the workers, update the database in this thread
+                for artifact, digests, exc in pool.map(compute, batch):
+                    if exc is not None:
+                        self.stderr.write("Unable to hash %s: %s\n" % (artifact, exc))
+                        continue
+                    Artifact.objects.filter(pk=artifact.pk).update(
+                        md5=digests[0], sha256=digests[1]
+                    )
+                    count += 1
+        self.stdout.write("%d artifacts updated\n" % count)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+#
+# Copyright 2017-present Linaro Limited
+#
+# Author: Rémi Duraffort <remi.duraffort@linaro.org>
+#
+# SPDX-License-Identifier: MIT
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from Artifactorial.models import Artifact, guess_content_type
+
+
+class Command(BaseCommand):
+    args = None
+    help = "Store the missing size, content type and mtime of artifacts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of artifacts to update in each transaction",
+        )
+
+    def handle(self, *args, **kwargs):
+        query = Artifact.objects.filter(
+            Q(size__isnull=True) | Q(stored_at__isnull=True) | Q(content_type="")
+        ).order_by("pk")
+        last_pk = 0
+        count = 0
+        while True:
+            batch = list(query.filter(pk__gt=last_pk)[: kwargs["batch_size"]])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            updated = []
+            for artifact in batch:
+                if not artifact.content_type:
+                    artifact.content_type = guess_content_type(artifact.path.name)
+                artifact.fill_metadata()
+                if artifact.size is None or artifact.stored_at is None:
+                    self.stderr.write("Unable to stat %s\n" % artifact)
+                    continue
+                updated.append(artifact)
+
+            with transaction.atomic():
+                for artifact in updated:
+                    Artifact.objects.filter(pk=artifact.pk).update(
+                        size=artifact.size,
+                        content_type=artifact.content_type,
+                        stored_at=artifact.stored_at,
+                    )
+            count += len(updated)
+            self.stdout.write("* %d artifacts updated\n" % count)
@@ -8,12 +8,22 @@
 #
 # SPDX-License-Identifier: MIT
 
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from Artifactorial.models import Directory
+from django.db import transaction
+from django.db.models import Count, Sum
+from Artifactorial.models import (
+    Directory,
+    PathNode,
+    drain_deletions,
+    folder_chain,
+    prune_folders,
+)
 
 import errno
 import os
+import time
 
 
 class Command(BaseCommand):
@@ -29,14 +39,106 @@ class Command(BaseCommand):
             help="Also remove permanent artifacts",
         )
         parser.add_argument("--ttl", default=None, help="Override directory TTL")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of artifacts to remove in each transaction",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of threads removing the files",
+        )
+        parser.add_argument(
+            "--time-budget",
+            type=int,
+            default=None,
+            help="Stop after this number of seconds",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            default=False,
+            help="Only print what would be removed",
+        )
+        parser.add_argument(
+            "--full-prune",
+            action="store_true",
+            default=False,
+            help="Look for empty directories in the whole MEDIA_ROOT",
+        )
 
     def handle(self, *args, **kwargs):
+        ttl = None if kwargs["ttl"] is None else int(kwargs["ttl"])
+        deadline = None
+        if kwargs["time_budget"] is not None:
+            deadline = time.monotonic() + kwargs["time_budget"]
+
         self.stdout.write("Removing old files in:\n")
-        for directory in Directory.objects.all():
-            self.stdout.write("* %s\n" % directory.path)
-            directory.clean_old_files(kwargs["purge"], kwargs["ttl"])
+        folders = set()
+        with ThreadPoolExecutor(max_workers=kwargs["workers"]) as executor:
+            for directory in Directory.objects.all().order_by("path"):
+                query = directory.old_files(kwargs["purge"], ttl)
+                if kwargs["dry_run"]:
+                    stats = query.aggregate(count=Count("pk"), size=Sum("size"))
+                    self.stdout.write(
+                        "* %s: would remove %d artifacts (%d bytes)\n"
+                        % (directory.path, stats["count"], stats["size"] or 0)
+                    )
+                    continue
+
+                count, size = directory.clean_old_files(
+                    kwargs["purge"],
+                    ttl,
+                    batch_size=kwargs["batch_size"],
+                    executor=executor,
+                    deadline=deadline,
+                    folders=folders,
+                )
+                self.stdout.write(
+                    "* %s: removed %d artifacts (%d bytes)\n"
+                    % (directory.path, count, size)
+                )
+                if deadline is not None and time.monotonic() >= deadline:
+                    self.stdout.write("Time budget exhausted\n")
+                    break
+
+            if not kwargs["dry_run"]:
+                count = drain_deletions(
+                    kwargs["batch_size"], executor, deadline, folders
+                )
+                self.stdout.write("Removed %d pending files\n" % count)
+
+        if kwargs["dry_run"]:
+            return
+
+        # The counters of the folders above a directory do not include its
+        # artifacts: these folders are kept
+        kept = set()
+        for path in Directory.objects.values_list("path", flat=True):
+            kept.update(folder_chain(path.strip("/")))
+        # Locking the empty folders: an upload might be adding a file
+        # concurrently. The condition is checked again once the lock is held.
+        with transaction.atomic():
+            rows = (
+                PathNode.objects.select_for_update()
+                .filter(file_count=0)
+                .order_by("path")
+                .values_list("pk", "path")
+            )
+            pks = [pk for (pk, path) in rows if path not in kept]
+            count, _ = PathNode.objects.filter(pk__in=pks).delete()
+        self.stdout.write("Removed %d empty folders\n" % count)
 
         self.stdout.write("Removing empty directories:\n")
+        if kwargs["full_prune"]:
+            self.full_prune()
+        else:
+            self.prune(folders)
+
+    def full_prune(self):
         for root, _, _ in os.walk(settings.MEDIA_ROOT, topdown=False):
             try:
                 os.rmdir(root)
@@ -45,3 +147,10 @@ class Command(BaseCommand):
                     self.stderr.write("Unable to remove %s: %s\n" % (root, exc))
             else:
                 self.stdout.write("* %s\n" % root)
+
+    def prune(self, folders):
+        for path, exc in prune_folders(folders):
+            if exc is None:
+                self.stdout.write("* %s\n" % path)
+            else:  # pragma: no cover
+                self.stderr.write("Unable to remove %s: %s\n" % (path, exc))
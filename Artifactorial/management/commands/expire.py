@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+#
+# Copyright 2017-present Linaro Limited
+#
+# Author: Rémi Duraffort <remi.duraffort@linaro.org>
+#
+# SPDX-License-Identifier: MIT
+
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections
+from django.utils import timezone
+from Artifactorial.models import (
+    Artifact,
+    delete_artifacts,
+    drain_deletions,
+    prune_folders,
+)
+
+import time
+
+
+class Command(BaseCommand):
+    args = None
+    help = "Remove the expired artifacts continuously"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of artifacts to remove in each transaction",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of threads removing the files",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0,
+            help="Seconds to wait between two batches",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=60,
+            help="Seconds to wait when no artifacts are expired",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            default=False,
+            help="Exit when no artifacts are expired",
+        )
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs["batch_size"]
+        with ThreadPoolExecutor(max_workers=kwargs["workers"]) as executor:
+            while True:
+                # Reconnect after a restart or a timeout of the database
+                close_old_connections()
+                try:
+                    count = self.expire(batch_size, executor)
+                    self.drain(batch_size, executor)
+                except OperationalError as exc:
+                    if kwargs["once"]:
+                        raise
+                    self.stderr.write("Database error: %s\n" % exc)
+                    close_old_connections()
+                    count = 0
+                if count >= batch_size:
+                    time.sleep(kwargs["pause"])
+                elif kwargs["once"]:
+                    break
+                else:
+                    time.sleep(kwargs["interval"])
+
+    def expire(self, batch_size, executor):
+        # Take the artifacts that expired first
+        now = timezone.now()
+        query = Artifact.objects.filter(expires_at__lte=now)
+        pks = list(
+            query.order_by("expires_at").values_list("pk", flat=True)[:batch_size]
+        )
+        if not pks:
+            return 0
+
+        folders = set()
+        count, size = delete_artifacts(
+            query.filter(pk__in=pks),
+            batch_size=batch_size,
+            executor=executor,
+            folders=folders,
+        )
+        self.stdout.write("Removed %d artifacts (%d bytes)\n" % (count, size))
+        self.prune(folders)
+        return len(pks)
+
+    def drain(self, batch_size, executor):
+        # Files of the artifacts deleted elsewhere and not yet removed
+        folders = set()
+        count = drain_deletions(batch_size, executor, folders=folders)
+        if count:
+            self.stdout.write("Removed %d pending files\n" % count)
+            self.prune(folders)
+
+    def prune(self, folders):
+        for path, exc in prune_folders(folders):
+            if exc is not None:  # pragma: no cover
+                self.stderr.write("Unable to remove %s: %s\n" % (path, exc))
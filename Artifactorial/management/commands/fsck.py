@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+#
+# Copyright 2017-present Linaro Limited
+#
+# Author: Rémi Duraffort <remi.duraffort@linaro.org>
+#
+# SPDX-License-Identifier: MIT
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import CharField, F, Func
+from django.utils import timezone
+from Artifactorial.models import (
+    Artifact,
+    delete_artifacts,
+    prune_folders,
+    unlink_files,
+)
+
+import os
+import time
+
+# Number of entries checked between two checkpoints
+CHECKPOINT_INTERVAL = 1000
+
+
+class BinaryOrder(Func):
+    """
+    Compare the paths code point by code point, like the sorted scan of the
+    disk, whatever the collation of the database.
+    """
+
+    template = "%(expressions)s"
+    output_field = CharField()
+
+    def as_postgresql(self, compiler, connection):
+        return self.as_sql(compiler, connection, template='%(expressions)s COLLATE "C"')
+
+
+def list_directory(path, errors):
+    """
+    Return the sorted (key, is_dir) entries of the directory, the key being
+    the name followed by "/" for directories: sorting the keys in each
+    directory sorts the full paths.
+
+    :param errors: list receiving the (path, exception) of the directories
+    that cannot be listed
+    """
+    try:
+        with os.scandir(path) as entries:
+            return sorted(
+                (
+                    (entry.name + "/", True)
+                    if entry.is_dir(follow_symlinks=False)
+                    else (entry.name, False)
+                )
+                for entry in entries
+            )
+    except FileNotFoundError:
+        return []
+    except OSError as exc:
+        errors.append((path, exc))
+        return []
+
+
+def walk(executor, root, folder, listing, errors, after=None):
+    """
+    Generate the names of the files below folder, sorted by path. The
+    sub-directories are listed in advance by the executor.
+
+    :param listing: the entries of folder, as returned by list_directory
+    :param errors: see list_directory
+    :param after: skip the names lower or equal to this one
+    """
+    names = []
+    for key, is_dir in listing:
+        name = folder + key
+        if is_dir:
+            # Every name in this sub-directory is lower than after
+            if after is not None and name < after and not after.startswith(name):
+                continue
+            names.append((name, executor.submit(list_directory, root + name, errors)))
+        elif not key.startswith(".upload-"):
+            if after is None or name > after:
+                names.append((name, None))
+
+    for name, future in names:
+        if future is None:
+            yield name
+        else:
+            yield from walk(executor, root, name, future.result(), errors, after)
+
+
+class Command(BaseCommand):
+    args = None
+    help = "Check that the artifacts and the files are matching"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--prefix", default="", help="Only check the files below this path"
+        )
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            default=False,
+            help="Remove the orphan files and the artifacts without files",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=None,
+            help="File recording the progress, to resume an interrupted run",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of threads listing the directories",
+        )
+        parser.add_argument(
+            "--grace",
+            type=int,
+            default=3600,
+            help="Ignore the orphan files modified in the last seconds",
+        )
+
+    def handle(self, *args, **kwargs):
+        prefix = kwargs["prefix"].strip("/")
+        prefix = prefix + "/" if prefix else ""
+        root = os.path.join(settings.MEDIA_ROOT, "")
+        checkpoint = kwargs["checkpoint"]
+        self.repair = kwargs["repair"]
+        self.recent = time.time() - kwargs["grace"]
+        self.root = root
+
+        after = None
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint, "r") as f_in:
+                after = f_in.read() or None
+            self.stdout.write("Resuming after %s\n" % after)
+
+        # The artifacts created during the scan might not be listed on disk:
+        # like the recent orphans, they are ignored
+        artifacts = (
+            Artifact.objects.filter(
+                path__startswith=prefix, created_at__lt=timezone.now()
+            )
+            .annotate(key=BinaryOrder(F("path")))
+            .order_by("key")
+            .values_list("pk", "key")
+        )
+        if after is not None:
+            artifacts = artifacts.filter(key__gt=after)
+
+        self.orphans, self.missing = ([], [])
+        self.folders = set()
+        self.errors = []
+        counts = {"files": 0, "artifacts": 0, "orphans": 0, "missing": 0}
+        with ThreadPoolExecutor(max_workers=kwargs["workers"]) as executor:
+            self.executor = executor
+            files = walk(
+                executor,
+                root,
+                prefix,
+                list_directory(root + prefix, self.errors),
+                self.errors,
+                after,
+            )
+            rows = artifacts.iterator()
+            name, row = (next(files, None), next(rows, None))
+            checked = 0
+            while name is not None or row is not None:
+                if row is None or (name is not None and name < row[1]):
+                    counts["files"] += 1
+                    if self.orphan(name):
+                        counts["orphans"] += 1
+                    last, name = (name, next(files, None))
+                elif name is None or row[1] < name:
+                    counts["artifacts"] += 1
+                    if self.missing_file(row):
+                        counts["missing"] += 1
+                    last, row = (row[1], next(rows, None))
+                else:
+                    counts["files"] += 1
+                    counts["artifacts"] += 1
+                    last, name, row = (name, next(files, None), next(rows, None))
+
+                checked += 1
+                if checked % CHECKPOINT_INTERVAL == 0:
+                    self.flush()
+                    if checkpoint is not None:
+                        with open(checkpoint + ".tmp", "w") as f_out:
+                            f_out.write(last)
+                        os.replace(checkpoint + ".tmp", checkpoint)
+            self.flush()
+
+        for path, exc in self.errors:
+            self.stderr.write("Unable to list %s: %s\n" % (path, exc))
+        for path, exc in prune_folders(self.folders):
+            if exc is not None:  # pragma: no cover
+                self.stderr.write("Unable to remove %s: %s\n" % (path, exc))
+        if checkpoint is not None and os.path.exists(checkpoint):
+            os.unlink(checkpoint)
+
+        self.stdout.write(
+            "Checked %(files)d files and %(artifacts)d artifacts: "
+            "%(orphans)d orphan files, %(missing)d missing files\n" % counts
+        )
+
+    def orphan(self, name):
+        # The artifact of a file being uploaded is not yet saved
+        try:
+            if os.stat(os.path.join(settings.MEDIA_ROOT, name)).st_mtime > self.recent:
+                return False
+        except FileNotFoundError:
+            return False
+        self.stdout.write("Orphan file: %s\n" % name)
+        self.orphans.append(name)
+        return True
+
+    def missing_file(self, row):
+        # The file might have been created after the listing of its folder
+        if os.path.exists(self.root + row[1]):
+            return False
+        # The files of the directories that cannot be listed are unknown
+        for path, _ in self.errors:
+            if row[1].startswith(os.path.join(path[len(self.root) :], "")):
+                return False
+        self.stdout.write("Missing file: %s\n" % row[1])
+        self.missing.append(row[0])
+        return True
+
+    def flush(self):
+        """
+        Apply the repairs found since the last call
+        """
+        if self.repair:
+            if self.orphans:
+                unlink_files(self.orphans, self.executor, self.folders)
+            if self.missing:
+                delete_artifacts(Artifact.objects.filter(pk__in=self.missing))
+        self.orphans, self.missing = ([], [])
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+#
+# Copyright 2017-present Linaro Limited
+#
+# Author: Rémi Duraffort <remi.duraffort@linaro.org>
+#
+# SPDX-License-Identifier: MIT
+
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from Artifactorial.models import Directory, delete_artifacts, prune_folders
+
+import time
+
+
+class Command(BaseCommand):
+    args = None
+    help = "Remove the directories scheduled for purge"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of artifacts to remove in each transaction",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of threads removing the files",
+        )
+        parser.add_argument(
+            "--time-budget",
+            type=int,
+            default=None,
+            help="Stop after this number of seconds",
+        )
+
+    def handle(self, *args, **kwargs):
+        deadline = None
+        if kwargs["time_budget"] is not None:
+            deadline = time.monotonic() + kwargs["time_budget"]
+
+        self.stdout.write("Purging directories:\n")
+        folders = set()
+        with ThreadPoolExecutor(max_workers=kwargs["workers"]) as executor:
+            for directory in Directory.objects.filter(is_deleting=True).order_by(
+                "path"
+            ):
+                count, size = delete_artifacts(
+                    directory.artifact_set.all(),
+                    batch_size=kwargs["batch_size"],
+                    executor=executor,
+                    deadline=deadline,
+                    folders=folders,
+                )
+                self.stdout.write(
+                    "* %s: removed %d artifacts (%d bytes)\n"
+                    % (directory.path, count, size)
+                )
+                # The next run will continue
+                if directory.artifact_set.exists():
+                    self.stdout.write("Time budget exhausted\n")
+                    break
+                directory.delete()
+
+        self.stdout.write("Removing empty directories:\n")
+        for path, exc in prune_folders(folders):
+            if exc is None:
+                self.stdout.write("* %s\n" % path)
+            else:  # pragma: no cover
+                self.stderr.write("Unable to remove %s: %s\n" % (path, exc))
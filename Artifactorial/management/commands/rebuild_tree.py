@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+#
+# Copyright 2017-present Linaro Limited
+#
+# Author: Rémi Duraffort <remi.duraffort@linaro.org>
+#
+# SPDX-License-Identifier: MIT
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from Artifactorial.models import Artifact, PathNode, build_path_tree
+
+
+class Command(BaseCommand):
+    args = None
+    help = "Rebuild the tree of folders from the artifacts"
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            PathNode.objects.all().delete()
+            count = build_path_tree(PathNode, Artifact)
+        self.stdout.write("Tree rebuilt with %d folders\n" % count)
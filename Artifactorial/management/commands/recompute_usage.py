@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+#
+# Copyright 2017-present Linaro Limited
+#
+# Author: Rémi Duraffort <remi.duraffort@linaro.org>
+#
+# SPDX-License-Identifier: MIT
+
+from django.core.management.base import BaseCommand
+from Artifactorial.models import Directory
+
+
+class Command(BaseCommand):
+    args = None
+    help = "Recompute the directories usage counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset-reservations",
+            action="store_true",
+            default=False,
+            help="Drop the quota reservations, only when no uploads are running",
+        )
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write("Recomputing usage of:\n")
+        for directory in Directory.objects.all().order_by("path"):
+            used_bytes, artifact_count = (
+                directory.used_bytes,
+                directory.artifact_count,
+            )
+            if directory.recompute_usage(kwargs["reset_reservations"]):
+                self.stdout.write(
+                    "* %s: fixed (%d bytes, %d artifacts => %d bytes, %d artifacts)\n"
+                    % (
+                        directory.path,
+                        used_bytes,
+                        artifact_count,
+                        directory.used_bytes,
+                        directory.artifact_count,
+                    )
+                )
+            else:
+                self.stdout.write("* %s: ok\n" % directory.path)
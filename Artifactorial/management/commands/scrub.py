@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+#
+# Copyright 2017-present Linaro Limited
+#
+# Author: Rémi Duraffort <remi.duraffort@linaro.org>
+#
+# SPDX-License-Identifier: MIT
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.utils import timezone
+from Artifactorial.models import Artifact
+
+import os
+import time
+
+
+class Throttle(object):
+    """
+    Limit the reading speed to rate bytes per second. The credit accumulated
+    while not reading is capped to burst seconds of reading: a slow stretch is
+    not followed by a read at full speed.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = rate * burst
+        self.last = time.monotonic()
+        self.allowance = 0
+
+    def __call__(self, size):
+        now = time.monotonic()
+        self.allowance = min(self.allowance + (now - self.last) * self.rate, self.burst)
+        self.last = now
+        self.allowance -= size
+        if self.allowance < 0:
+            time.sleep(-self.allowance / self.rate)
+
+
+class Command(BaseCommand):
+    args = None
+    help = "Verify the digests of the artifacts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--bandwidth",
+            type=float,
+            default=None,
+            help="Maximum reading speed in MiB per second",
+        )
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=30,
+            help="Skip the artifacts verified in the last days",
+        )
+        parser.add_argument(
+            "--time-budget",
+            type=int,
+            default=None,
+            help="Stop after this number of seconds",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of artifacts to load at once",
+        )
+
+    def handle(self, *args, **kwargs):
+        deadline = None
+        if kwargs["time_budget"] is not None:
+            deadline = time.monotonic() + kwargs["time_budget"]
+        throttle = None
+        if kwargs["bandwidth"]:
+            throttle = Throttle(kwargs["bandwidth"] * 1024 * 1024)
+
+        # Never verified first, then the least recently verified. The
+        # verified artifacts are leaving the query.
+        verified_before = timezone.now() - timedelta(days=kwargs["min_age"])
+        query = (
+            Artifact.objects.filter(
+                Q(last_verified_at__isnull=True)
+                | Q(last_verified_at__lt=verified_before)
+            )
+            .order_by(F("last_verified_at").asc(nulls_first=True), "pk")
+            .only("path", "size", "md5", "sha256")
+        )
+        counts = {"verified": 0, "size": 0, "corrupted": 0, "missing": 0}
+        failed = []
+        while deadline is None or time.monotonic() < deadline:
+            batch = list(query.exclude(pk__in=failed)[: kwargs["batch_size"]])
+            if not batch:
+                break
+            for artifact in batch:
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                error = self.verify(artifact, throttle)
+                if error is None:
+                    counts["verified"] += 1
+                    counts["size"] += artifact.size or 0
+                else:
+                    # Reported again by the next runs
+                    counts[error] += 1
+                    failed.append(artifact.pk)
+
+        self.stdout.write(
+            "Verified %(verified)d artifacts (%(size)d bytes): "
+            "%(corrupted)d corrupted, %(missing)d missing\n" % counts
+        )
+
+    def verify(self, artifact, throttle):
+        """
+        Check the size and digests of the artifact and record the verification.
+        Older artifacts without digests are only hashed.
+
+        :return: None, "corrupted" or "missing"
+        """
+        try:
+            size = os.stat(artifact.path.path).st_size
+            if artifact.size is not None and size != artifact.size:
+                self.stdout.write(
+                    "Corrupted file: %s (%d bytes instead of %d)\n"
+                    % (artifact.path.name, size, artifact.size)
+                )
+                return "corrupted"
+            digests = artifact.compute_digests(throttle)
+        except FileNotFoundError:
+            self.stdout.write("Missing file: %s\n" % artifact.path.name)
+            return "missing"
+
+        values = {"last_verified_at": timezone.now()}
+        if not artifact.md5 or not artifact.sha256:
+            values["md5"], values["sha256"] = digests
+        elif digests != (artifact.md5, artifact.sha256):
+            self.stdout.write("Corrupted file: %s (digests)\n" % artifact.path.name)
+            return "corrupted"
+        Artifact.objects.filter(pk=artifact.pk).update(**values)
+        return None
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Artifactorial", "0006_directory_on_delete"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="artifact",
+            name="md5",
+            field=models.CharField(blank=True, default="", max_length=32),
+        ),
+        migrations.AddField(
+            model_name="artifact",
+            name="sha256",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Artifactorial", "0007_artifact_digests"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="directory",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
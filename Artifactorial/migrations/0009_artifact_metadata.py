@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Artifactorial", "0008_directory_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="artifact",
+            name="content_type",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+        migrations.AddField(
+            model_name="artifact",
+            name="size",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="artifact",
+            name="stored_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
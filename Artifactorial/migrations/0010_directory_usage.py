@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def compute_usage(apps, schema_editor):
+    Artifact = apps.get_model("Artifactorial", "Artifact")
+    Directory = apps.get_model("Artifactorial", "Directory")
+    artifacts = (
+        Artifact.objects.filter(directory=OuterRef("pk")).order_by().values("directory")
+    )
+    sizes = artifacts.annotate(total=Sum("size")).values("total")
+    counts = artifacts.annotate(total=Count("pk")).values("total")
+    Directory.objects.update(
+        used_bytes=Coalesce(Subquery(sizes), 0),
+        artifact_count=Coalesce(Subquery(counts), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Artifactorial", "0009_artifact_metadata"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="directory",
+            name="artifact_count",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="directory",
+            name="used_bytes",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compute_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Artifactorial", "0010_directory_usage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="directory",
+            name="reserved_bytes",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
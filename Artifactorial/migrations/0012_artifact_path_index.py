@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:25
+
+import Artifactorial.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Artifactorial", "0011_directory_reserved_bytes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="artifact",
+            name="path",
+            field=models.FileField(
+                db_index=True, upload_to=Artifactorial.models.get_path_name
+            ),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from Artifactorial.models import build_path_tree
+
+
+def build_tree(apps, schema_editor):
+    build_path_tree(
+        apps.get_model("Artifactorial", "PathNode"),
+        apps.get_model("Artifactorial", "Artifact"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Artifactorial", "0012_artifact_path_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PathNode",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("path", models.CharField(max_length=255, unique=True)),
+                ("name", models.CharField(max_length=255)),
+                ("size", models.BigIntegerField(default=0)),
+                ("file_count", models.BigIntegerField(default=0)),
+                ("latest_mtime", models.DateTimeField(blank=True, null=True)),
+                (
+                    "parent",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="children",
+                        to="Artifactorial.PathNode",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="artifact",
+            name="node",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="artifacts",
+                to="Artifactorial.PathNode",
+            ),
+        ),
+        migrations.RunPython(build_tree, migrations.RunPython.noop),
+    ]
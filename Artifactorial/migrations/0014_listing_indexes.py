@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Artifactorial", "0013_path_tree"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="artifact",
+            index=models.Index(
+                fields=["node", "path"], name="Artifactori_node_id_df9b69_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pathnode",
+            index=models.Index(
+                fields=["parent", "name"], name="Artifactori_parent__c1c6b3_idx"
+            ),
+        ),
+    ]
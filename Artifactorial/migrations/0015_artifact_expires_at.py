@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:48
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def set_expires_at(apps, schema_editor):
+    Artifact = apps.get_model("Artifactorial", "Artifact")
+    Directory = apps.get_model("Artifactorial", "Directory")
+    for directory in Directory.objects.filter(ttl__gt=0):
+        Artifact.objects.filter(directory=directory, is_permanent=False).update(
+            expires_at=models.ExpressionWrapper(
+                models.F("created_at") + timedelta(days=directory.ttl),
+                output_field=models.DateTimeField(),
+            )
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Artifactorial", "0014_listing_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="artifact",
+            name="expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="artifact",
+            index=models.Index(
+                fields=["expires_at", "directory"],
+                name="Artifactori_expires_fb8c65_idx",
+            ),
+        ),
+        migrations.RunPython(set_expires_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 02:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Artifactorial", "0016_pending_deletion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="directory",
+            name="is_deleting",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Artifactorial", "0017_directory_is_deleting"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="artifact",
+            name="last_verified_at",
+            field=models.DateTimeField(
+                blank=True, db_index=True, editable=False, null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+from Artifactorial.models import build_path_tree
+
+
+def rebuild_tree(apps, schema_editor):
+    # The root folder is dropped and the folders above the directories are no
+    # longer counting their artifacts
+    PathNode = apps.get_model("Artifactorial", "PathNode")
+    PathNode.objects.all().delete()
+    build_path_tree(PathNode, apps.get_model("Artifactorial", "Artifact"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Artifactorial", "0018_artifact_last_verified_at"),
+    ]
+
+    operations = [migrations.RunPython(rebuild_tree, migrations.RunPython.noop)]
@@ -8,16 +8,26 @@
 #
 # SPDX-License-Identifier: MIT
 
+from django.conf import settings
 from django.contrib.auth.models import User, Group
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.timezone import datetime, utc
 
+from Artifactorial.permissions import PermissionResolver
+
 import binascii
 from datetime import timedelta
+import errno
+import hashlib
+import mimetypes
 import os
+import time
 
 
 def random_hash():
@@ -49,6 +59,17 @@ class Directory(models.Model):
         validators=[MinValueValidator(1)],
         help_text="Size limit in Bytes",
     )
+    # Updated when the directory or its content is modified
+    updated_at = models.DateTimeField(auto_now=True)
+    # Usage counters, updated when artifacts are created or deleted
+    used_bytes = models.BigIntegerField(default=0, editable=False)
+    artifact_count = models.BigIntegerField(default=0, editable=False)
+    # Bytes reserved by the uploads in progress
+    reserved_bytes = models.BigIntegerField(default=0, editable=False)
+    # Hidden and removed in batches by the purge command
+    is_deleting = models.BooleanField(default=False, editable=False)
+
+    COUNTERS = ["used_bytes", "artifact_count", "reserved_bytes"]
 
     class Meta:
         verbose_name_plural = "Directories"
@@ -77,6 +98,20 @@ class Directory(models.Model):
     def get_absolute_url(self):
         return reverse("artifacts", args=[self.path[1:] + "/"])
 
+    def save(self, *args, **kwargs):
+        # The usage counters are only updated using F() expressions and the
+        # purge with schedule_purge(). Do not overwrite them with the (maybe
+        # outdated) values of this instance.
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                f.name
+                for f in self._meta.concrete_fields
+                if not f.primary_key
+                and f.name not in self.COUNTERS
+                and f.name != "is_deleting"
+            ]
+        super().save(*args, **kwargs)
+
     def is_visible_to(self, user):
         """
         Check that the current directory is visible to the current user
@@ -86,14 +121,7 @@ class Directory(models.Model):
         :param user: the user to check
         :return: True if the directory is visible to the user, False otherwise.
         """
-        if self.is_public:
-            return True
-        if self.user is not None:
-            return self.user == user
-        elif self.group is not None:
-            return self.group in user.groups.all()
-        else:
-            return user.is_active
+        return PermissionResolver(user).is_visible(self)
 
     def is_writable_to(self, user):
         """
@@ -103,41 +131,250 @@ class Directory(models.Model):
         :param user: the user to check
         :return: True if the user can write to this directory, False otherwise.
         """
-        if self.user is not None:
-            return self.user == user
-        elif self.group is not None:
-            return self.group in user.groups.all()
-        else:
-            return True
+        return PermissionResolver(user).is_writable(self)
 
     def size(self):
-        size = 0
-        for artifact in self.artifact_set.all():
-            size += artifact.path.size
-        return size
+        self.refresh_from_db(fields=self.COUNTERS)
+        return self.used_bytes
+
+    def reserve(self, size):
+        """
+        Reserve some bytes of the quota for an upload in progress.
+
+        The check and the reservation are done in a single conditional
+        UPDATE so concurrent uploads cannot exceed the quota.
+        The reservation should be released with release(), in the
+        transaction that creates the artifact or when the upload fails.
+
+        :param size: the number of bytes to reserve
+        :return: True if the quota allows the reservation, False otherwise
+        """
+        return bool(
+            Directory.objects.filter(
+                pk=self.pk, quota__gte=F("used_bytes") + F("reserved_bytes") + size
+            ).update(reserved_bytes=F("reserved_bytes") + size)
+        )
+
+    def release(self, size):
+        """
+        Release a reservation made with reserve().
+        """
+        Directory.objects.filter(pk=self.pk).update(
+            reserved_bytes=F("reserved_bytes") - size
+        )
+
+    def recompute_usage(self, reset_reservations=False):
+        """
+        Recompute the usage counters from the artifacts, in one statement.
+
+        :param reset_reservations: also drop the reservations. Only safe when
+        no uploads are in progress.
+        :return: True if the counters were wrong
+        """
+        artifacts = (
+            Artifact.objects.filter(directory=OuterRef("pk"))
+            .order_by()
+            .values("directory")
+        )
+        sizes = artifacts.annotate(total=Sum("size")).values("total")
+        counts = artifacts.annotate(total=Count("pk")).values("total")
+        values = {
+            "used_bytes": Coalesce(Subquery(sizes), 0),
+            "artifact_count": Coalesce(Subquery(counts), 0),
+        }
+        if reset_reservations:
+            values["reserved_bytes"] = 0
+        Directory.objects.filter(pk=self.pk).update(**values)
+        before = [getattr(self, name) for name in self.COUNTERS]
+        self.refresh_from_db(fields=self.COUNTERS)
+        return before != [getattr(self, name) for name in self.COUNTERS]
 
     def quota_progress(self):
-        return int(round(float(self.size()) / self.quota * 100))
+        # Listed for every directory: use the counters already loaded
+        return int(round(float(self.used_bytes) / self.quota * 100))
 
-    def clean_old_files(self, purge, override_ttl=None):
+    def schedule_purge(self):
         """
-        Remove old artifacts by comparing to the TTL
-        When purge is True, remove also permanent artifacts
+        Hide the directory and its artifacts immediately. They are removed in
+        batches by the purge command.
+        """
+        self.is_deleting = True
+        Directory.objects.filter(pk=self.pk).update(
+            is_deleting=True, updated_at=timezone.now()
+        )
+
+    def get_expiration(self, ttl=None, start=None):
+        """
+        Return the expiration date of an artifact created at start (now by
+        default) or None if it never expires.
+
+        :param ttl: override the TTL of the directory (in days)
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return None
+        return (start or timezone.now()) + timedelta(days=ttl)
+
+    def old_files(self, purge, override_ttl=None):
+        """
+        Return the expired artifacts. When purge is True or override_ttl is
+        set, return the old artifacts by comparing to the TTL instead.
+        When purge is True, return also permanent artifacts
         """
+        if override_ttl is None and not purge:
+            return self.artifact_set.filter(expires_at__lte=timezone.now())
         # Use the TTL passed as argument if not empty
         ttl = override_ttl if override_ttl is not None else self.ttl
         ttl = max(ttl, 0)
         # A negative TTL mean that we should not remove old files
         # Except when purge is True (we will remove everything)
         if ttl == 0 and not purge:
-            return
+            return self.artifact_set.none()
         now = datetime.utcnow().replace(tzinfo=utc)
         older_than = now - timedelta(days=ttl)
         query = self.artifact_set.filter(created_at__lt=older_than)
         # Also remove permanent artifacts
         if not purge:
             query = query.exclude(is_permanent=True)
-        query.delete()
+        return query
+
+    def clean_old_files(self, purge, override_ttl=None, **kwargs):
+        """
+        Remove old artifacts by comparing to the TTL
+        When purge is True, remove also permanent artifacts
+        See delete_artifacts for the other arguments.
+
+        :return: a tuple (count, size) of the removed artifacts
+        """
+        return delete_artifacts(self.old_files(purge, override_ttl), **kwargs)
+
+
+def guess_content_type(filename):
+    mime = mimetypes.guess_type(filename)
+    return mime[0] if mime[0] else "text/plain"
+
+
+def folder_chain(folder, top=""):
+    """
+    Return the paths of the folder and all its parents below top (included),
+    top first. The root of MEDIA_ROOT is never part of the chain.
+    """
+    parts = folder.split("/") if folder else []
+    start = len(top.split("/")) if top else 1
+    return ["/".join(parts[:i]) for i in range(start, len(parts) + 1)]
+
+
+class PathNode(models.Model):
+    """
+    A folder in the tree of artifacts: either a real directory, one of its
+    parents or a pseudo directory. The sizes, counts and modification time
+    include every artifact below the folder.
+    """
+
+    path = models.CharField(max_length=255, unique=True)
+    parent = models.ForeignKey(
+        "self",
+        null=True,
+        blank=True,
+        related_name="children",
+        on_delete=models.CASCADE,
+    )
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField(default=0)
+    file_count = models.BigIntegerField(default=0)
+    latest_mtime = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # Paginated listings of the children
+        indexes = [models.Index(fields=["parent", "name"])]
+
+    def __str__(self):
+        return "/" + self.path
+
+    @classmethod
+    def get_or_create_folder(cls, folder, top=""):
+        """
+        Return the node for this folder, creating the missing parents.
+
+        The nodes below top, the path of the directory of the artifact, are
+        locked until the end of the transaction: the clean command cannot
+        remove the empty ones before their counters are updated. Should be
+        called in a transaction.
+        """
+        nodes = {
+            node.path: node
+            for node in cls.objects.select_for_update()
+            .filter(path__in=folder_chain(folder, top))
+            .order_by("path")
+        }
+        if folder in nodes:
+            return nodes[folder]
+        node, parent = (None, None)
+        for path in folder_chain(folder):
+            node = nodes.get(path)
+            if node is None:
+                node, _ = cls.objects.get_or_create(
+                    path=path,
+                    defaults={"parent": parent, "name": os.path.basename(path)},
+                )
+            parent = node
+        return node
+
+    @classmethod
+    def update_folder(cls, folder, size, count, top=""):
+        """
+        Update the counters of the folder and all its parents below top, the
+        path of the directory of the artifacts. The counters of a folder only
+        include the artifacts of the directories containing it.
+        """
+        cls.objects.filter(path__in=folder_chain(folder, top)).update(
+            size=F("size") + size,
+            file_count=F("file_count") + count,
+            latest_mtime=timezone.now(),
+        )
+
+
+def build_path_tree(node_model, artifact_model):
+    """
+    Build the tree of folders from the artifacts. The table of nodes should
+    be empty. The models are arguments to be usable from migrations.
+    """
+    folders = {}
+    artifacts = artifact_model.objects.order_by("pk")
+    for pk, path, size, stored_at, top in artifacts.values_list(
+        "pk", "path", "size", "stored_at", "directory__path"
+    ).iterator():
+        folder = os.path.dirname(path).strip("/")
+        # The parents above the directory are only created
+        for parent in folder_chain(folder):
+            folders.setdefault(parent, [0, 0, None, []])
+        for parent in folder_chain(folder, top.strip("/")):
+            data = folders[parent]
+            data[0] += size or 0
+            data[1] += 1
+            if stored_at is not None and (data[2] is None or stored_at > data[2]):
+                data[2] = stored_at
+        if folder:
+            folders[folder][3].append(pk)
+
+    # Parents are sorted before their children
+    nodes = {}
+    for path in sorted(folders):
+        size, count, mtime, pks = folders[path]
+        parent = nodes.get(os.path.dirname(path))
+        nodes[path] = node_model.objects.create(
+            path=path,
+            parent=parent,
+            name=os.path.basename(path),
+            size=size,
+            file_count=count,
+            latest_mtime=mtime,
+        )
+        for index in range(0, len(pks), 500):
+            artifact_model.objects.filter(pk__in=pks[index : index + 500]).update(
+                node=nodes[path]
+            )
+    return len(nodes)
 
 
 def get_path_name(instance, filename):
@@ -151,14 +388,73 @@ def get_path_name(instance, filename):
 
 
 class Artifact(models.Model):
-    path = models.FileField(upload_to=get_path_name)
+    path = models.FileField(upload_to=get_path_name, db_index=True)
     directory = models.ForeignKey(Directory, blank=False, on_delete=models.CASCADE)
     is_permanent = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    md5 = models.CharField(max_length=32, blank=True, default="")
+    sha256 = models.CharField(max_length=64, blank=True, default="")
+    # File metadata, stored to avoid accessing the filesystem
+    size = models.BigIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=255, blank=True, default="")
+    stored_at = models.DateTimeField(null=True, blank=True)
+    # Computed when the artifact is created, NULL for permanent artifacts
+    expires_at = models.DateTimeField(null=True, blank=True)
+    # Last time the digests were verified by the scrub command
+    last_verified_at = models.DateTimeField(
+        null=True, blank=True, editable=False, db_index=True
+    )
+    node = models.ForeignKey(
+        PathNode,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="artifacts",
+        on_delete=models.SET_NULL,
+    )
+
+    class Meta:
+        indexes = [
+            # Paginated listings of the artifacts of a folder
+            models.Index(fields=["node", "path"]),
+            # Due artifacts, in every directory (expire) or in one (clean)
+            models.Index(fields=["expires_at", "directory"]),
+        ]
 
     def __str__(self):
         return self.path.name
 
+    def save(self, *args, **kwargs):
+        if not self.content_type:
+            self.content_type = guess_content_type(self.path.name)
+        if self.size is None or self.stored_at is None:
+            self.fill_metadata()
+        if self.is_permanent:
+            self.expires_at = None
+        elif self.expires_at is None:
+            self.expires_at = self.directory.get_expiration(start=self.created_at)
+        super().save(*args, **kwargs)
+
+    def fill_metadata(self):
+        """
+        Set the missing size and stored_at from the file itself.
+        """
+        if not self.path._committed:
+            # The file is not yet saved into the storage
+            if self.size is None:
+                self.size = self.path.size
+            if self.stored_at is None:
+                self.stored_at = timezone.now()
+            return
+        try:
+            stat = os.stat(self.path.path)
+        except OSError:
+            return
+        if self.size is None:
+            self.size = stat.st_size
+        if self.stored_at is None:
+            self.stored_at = datetime.fromtimestamp(stat.st_mtime, tz=utc)
+
     def get_absolute_url(self):
         return reverse("artifacts", args=[self.path.name])
 
@@ -168,6 +464,23 @@ class Artifact(models.Model):
     def is_writable_to(self, user):
         return self.directory.is_writable_to(user)
 
+    def compute_digests(self, throttle=None):
+        """
+        Read the file and compute the digests
+
+        :param throttle: called with the size of each chunk read
+        :return: the (md5, sha256) hexadecimal digests
+        """
+        md5 = hashlib.md5()
+        sha256 = hashlib.sha256()
+        with open(self.path.path, "rb") as f_in:
+            for chunk in iter(lambda: f_in.read(1024 * 1024), b""):
+                md5.update(chunk)
+                sha256.update(chunk)
+                if throttle is not None:
+                    throttle(len(chunk))
+        return (md5.hexdigest(), sha256.hexdigest())
+
 
 class Share(models.Model):
     token = models.TextField(max_length=32, unique=True, default=random_hash)
@@ -179,3 +492,190 @@ class Share(models.Model):
 
     def get_absolute_url(self):
         return reverse("shares", args=[self.token])
+
+
+class PendingDeletion(models.Model):
+    """
+    A file to remove from the storage. The row is created in the transaction
+    that deletes the artifact and removed once the file is unlinked.
+    """
+
+    path = models.CharField(max_length=255, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.path
+
+
+def unlink_files(names, executor=None, folders=None):
+    """
+    Remove the files from the storage and then the pending deletions.
+
+    :param names: the storage names of the files
+    :param executor: the concurrent.futures executor removing the files
+    :param folders: a set collecting the folders of the removed files
+    """
+    storage = Artifact._meta.get_field("path").storage
+    if executor is None:
+        list(map(storage.delete, names))
+    else:
+        list(executor.map(storage.delete, names))
+    PendingDeletion.objects.filter(path__in=names).delete()
+    if folders is not None:
+        folders.update(os.path.dirname(name) for name in names)
+
+
+def drain_deletions(batch_size=1000, executor=None, deadline=None, folders=None):
+    """
+    Remove the files of the pending deletions in batches of batch_size files.
+    See unlink_files for the other arguments.
+
+    :return: the number of removed files
+    """
+    storage = Artifact._meta.get_field("path").storage
+    last_pk = 0
+    count = 0
+    while deadline is None or time.monotonic() < deadline:
+        rows = list(
+            PendingDeletion.objects.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", "path")[:batch_size]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        # Keep the files that were uploaded again with the same name
+        names = set(row[1] for row in rows)
+        names -= set(
+            Artifact.objects.filter(path__in=names).values_list("path", flat=True)
+        )
+        if executor is None:
+            list(map(storage.delete, names))
+        else:
+            list(executor.map(storage.delete, names))
+        PendingDeletion.objects.filter(pk__in=[row[0] for row in rows]).delete()
+        if folders is not None:
+            folders.update(os.path.dirname(name) for name in names)
+        count += len(rows)
+    return count
+
+
+def delete_rows(model, pks):
+    """
+    Delete the rows with a single DELETE query, without collecting the related
+    objects nor sending the delete signals: the caller is responsible for
+    both.
+
+    :return: the number of deleted rows
+    """
+    if not pks:
+        return 0
+    opts = model._meta
+    # The identifiers come from the model and the values are parameters
+    with connection.cursor() as cursor:
+        cursor.execute(  # nosec
+            "DELETE FROM %s WHERE %s IN (%s)"
+            % (
+                connection.ops.quote_name(opts.db_table),
+                connection.ops.quote_name(opts.pk.column),
+                ", ".join(["%s"] * len(pks)),
+            ),
+            pks,
+        )
+        return cursor.rowcount
+
+
+def delete_artifacts(
+    query, batch_size=1000, executor=None, deadline=None, folders=None
+):
+    """
+    Remove the artifacts in batches of batch_size artifacts, each in its own
+    transaction. The counters of the directories and folders are updated
+    once per batch and the files are removed after the commit.
+    See unlink_files for the other arguments.
+
+    :param query: the artifacts to remove
+    :param deadline: stop after this time.monotonic() value
+    :return: a tuple (count, size) of the removed artifacts
+    """
+    query = query.order_by("pk").values_list("pk", flat=True)
+    last_pk = 0
+    count, size = (0, 0)
+    while deadline is None or time.monotonic() < deadline:
+        pks = list(query.filter(pk__gt=last_pk)[:batch_size])
+        if not pks:
+            break
+        last_pk = pks[-1]
+
+        with transaction.atomic():
+            # Lock the rows: concurrent deletions are not counted twice
+            rows = list(
+                Artifact.objects.select_for_update()
+                .filter(pk__in=pks)
+                .values_list("pk", "path", "size", "directory_id")
+            )
+            pks = [row[0] for row in rows]
+            Share.objects.filter(artifact__in=pks).delete()
+            # Bypass the post_delete signal sent for each artifact
+            delete_rows(Artifact, pks)
+            PendingDeletion.objects.bulk_create(
+                [PendingDeletion(path=row[1]) for row in rows]
+            )
+
+            directories = {}
+            nodes = {}
+            paths = dict(
+                Directory.objects.filter(
+                    pk__in=set(row[3] for row in rows)
+                ).values_list("pk", "path")
+            )
+            for _, path, art_size, directory_id in rows:
+                folder = os.path.dirname(path).strip("/")
+                top = paths[directory_id].strip("/")
+                for key, counters in [
+                    (directory_id, directories),
+                    ((folder, top), nodes),
+                ]:
+                    data = counters.setdefault(key, [0, 0])
+                    data[0] += art_size or 0
+                    data[1] += 1
+            now = timezone.now()
+            for directory_id, (dir_size, dir_count) in directories.items():
+                Directory.objects.filter(pk=directory_id).update(
+                    used_bytes=F("used_bytes") - dir_size,
+                    artifact_count=F("artifact_count") - dir_count,
+                    updated_at=now,
+                )
+            for (folder, top), (folder_size, folder_count) in nodes.items():
+                PathNode.update_folder(folder, -folder_size, -folder_count, top)
+
+        unlink_files([row[1] for row in rows], executor, folders)
+        count += len(rows)
+        size += sum(row[2] or 0 for row in rows)
+    return (count, size)
+
+
+def prune_folders(folders):
+    """
+    Remove the given folders (relative to MEDIA_ROOT) when they are empty,
+    walking upward until a directory is not empty. The deepest folders are
+    pruned first.
+
+    :return: a generator of (path, exception) for the removed directories
+    (the exception being None) and the errors
+    """
+    root = os.path.normpath(settings.MEDIA_ROOT)
+    for folder in sorted(folders, key=lambda f: (-f.count("/"), f)):
+        path = os.path.normpath(os.path.join(root, folder))
+        while path.startswith(root + os.sep):
+            try:
+                os.rmdir(path)
+            except OSError as exc:
+                if exc.errno == errno.ENOTEMPTY:
+                    break
+                if exc.errno != errno.ENOENT:  # pragma: no cover
+                    yield (path, exc)
+                    break
+            else:
+                yield (path, None)
+            path = os.path.dirname(path)
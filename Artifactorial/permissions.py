@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+#
+# Copyright 2017-present Linaro Limited
+#
+# Author: Rémi Duraffort <remi.duraffort@linaro.org>
+#
+# SPDX-License-Identifier: MIT
+
+from django.db.models import Q
+
+
+class PermissionResolver(object):
+    """
+    Check the permissions of one user on many directories. The groups of the
+    user are only loaded once.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._group_ids = None
+
+    @property
+    def group_ids(self):
+        if self._group_ids is None:
+            if self.user.is_authenticated:
+                self._group_ids = frozenset(
+                    self.user.groups.values_list("id", flat=True)
+                )
+            else:
+                self._group_ids = frozenset()
+        return self._group_ids
+
+    def is_visible(self, directory):
+        """
+        A public directory is visible to all.
+        An anonymous directory is visible to all active users.
+        """
+        if directory.is_public:
+            return True
+        if directory.user_id is not None:
+            return directory.user_id == self.user.pk
+        elif directory.group_id is not None:
+            return directory.group_id in self.group_ids
+        else:
+            return self.user.is_active
+
+    def is_writable(self, directory):
+        """An anonymous directory is writable to all."""
+        if directory.user_id is not None:
+            return directory.user_id == self.user.pk
+        elif directory.group_id is not None:
+            return directory.group_id in self.group_ids
+        else:
+            return True
+
+    def visible_q(self, prefix=""):
+        """
+        Return the filter selecting the directories visible to the user.
+
+        :param prefix: the lookup to the directory, like "directory__"
+        """
+        query = Q(**{prefix + "is_public": True})
+        if self.user.is_authenticated:
+            query |= Q(**{prefix + "user": self.user})
+        if self.group_ids:
+            query |= Q(
+                **{
+                    prefix + "user__isnull": True,
+                    prefix + "group__in": self.group_ids,
+                }
+            )
+        if self.user.is_active:
+            query |= Q(
+                **{prefix + "user__isnull": True, prefix + "group__isnull": True}
+            )
+        return query
+
+
+def get_resolver(request, user):
+    """Return the resolver of this user, cached for the whole request"""
+    resolvers = request.__dict__.setdefault("_artifactorial_resolvers", {})
+    if user.pk not in resolvers:
+        resolvers[user.pk] = PermissionResolver(user)
+    return resolvers[user.pk]
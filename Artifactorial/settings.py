@@ -14,3 +14,37 @@ LOGIN_REDIRECT_URL = "artifacts.root"
 # Redirection after logging-out
 # Only when Django 1.10 is available on all systems
 # LOGOUT_REDIRECT_URL
+
+# How to send the artifacts to the clients:
+# * "django": stream the file from the Django process
+# * "nginx": delegate to nginx using X-Accel-Redirect
+# * "apache": delegate to apache using X-Sendfile (mod_xsendfile)
+ARTIFACTORIAL_DOWNLOAD_BACKEND = "django"
+
+# The nginx internal location that maps to MEDIA_ROOT
+ARTIFACTORIAL_DOWNLOAD_NGINX_LOCATION = "/protected/"
+
+# How long (in seconds) can caches keep the permanent artifacts
+ARTIFACTORIAL_PERMANENT_MAX_AGE = 30 * 24 * 60 * 60
+
+# Bytes tolerated above the available quota in the Content-Length of an
+# upload (multipart framing and other fields)
+ARTIFACTORIAL_UPLOAD_OVERHEAD = 64 * 1024
+
+# Number of entries in each page of the HTML listings
+ARTIFACTORIAL_LISTING_PAGE_SIZE = 1000
+
+# Cache of the authentication tokens: number of tokens kept by each process,
+# validity (in seconds, 0 to disable the cache) and name of the optional
+# shared cache (in CACHES)
+ARTIFACTORIAL_TOKEN_CACHE_SIZE = 1024
+ARTIFACTORIAL_TOKEN_CACHE_TTL = 60
+ARTIFACTORIAL_TOKEN_CACHE = None
+
+# Default and maximal validity (in seconds) of the signed URLs
+ARTIFACTORIAL_SIGNED_URL_TTL = 60 * 60
+ARTIFACTORIAL_SIGNED_URL_MAX_TTL = 7 * 24 * 60 * 60
+
+# Remove the files of the deleted artifacts right after the commit. When
+# disabled, the files are only removed by the clean and expire commands.
+ARTIFACTORIAL_INLINE_DELETION = True
@@ -8,12 +8,80 @@
 #
 # SPDX-License-Identifier: MIT
 
-from django.db.models.signals import post_delete
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from Artifactorial.models import Artifact
+from django.utils import timezone
+from Artifactorial import authentication
+from Artifactorial.models import (
+    Artifact,
+    AuthToken,
+    Directory,
+    PathNode,
+    PendingDeletion,
+    unlink_files,
+)
+
+import os
+
+
+def update_directory(artifact, count):
+    """
+    Update the directory usage counters and change marker. This is done in
+    the transaction that creates or deletes the artifact.
+    """
+    Directory.objects.filter(pk=artifact.directory_id).update(
+        used_bytes=F("used_bytes") + count * (artifact.size or 0),
+        artifact_count=F("artifact_count") + count,
+        updated_at=timezone.now(),
+    )
+
+
+def update_tree(artifact, count):
+    """
+    Update the folders containing the artifact, creating them if needed.
+    Empty folders are kept and removed by the clean command.
+    """
+    folder = os.path.dirname(artifact.path.name).strip("/")
+    top = artifact.directory.path.strip("/")
+    # The folders are locked until their counters are updated
+    with transaction.atomic():
+        if count > 0:
+            artifact.node = PathNode.get_or_create_folder(folder, top)
+            Artifact.objects.filter(pk=artifact.pk).update(node=artifact.node)
+        PathNode.update_folder(folder, count * (artifact.size or 0), count, top)
+
+
+def delete_file(name):
+    """
+    Record the pending deletion in the transaction that deletes the artifact
+    and remove the file once committed. If the transaction is rolled back, the
+    file is kept, and if the process dies before unlinking it, the file is
+    removed by the clean and expire commands.
+    """
+    PendingDeletion.objects.create(path=name)
+    if getattr(settings, "ARTIFACTORIAL_INLINE_DELETION", True):
+        transaction.on_commit(lambda: unlink_files([name]))
+
+
+@receiver(post_save, sender=Artifact)
+def artifact_post_save(sender, **kwargs):
+    if kwargs["created"]:
+        update_directory(kwargs["instance"], 1)
+        update_tree(kwargs["instance"], 1)
 
 
 @receiver(post_delete, sender=Artifact)
 def artifact_post_delete(sender, **kwargs):
     artifact = kwargs["instance"]
-    artifact.path.storage.delete(artifact.path.path)
+    delete_file(artifact.path.name)
+    update_directory(artifact, -1)
+    update_tree(artifact, -1)
+
+
+@receiver(post_save, sender=AuthToken)
+@receiver(post_delete, sender=AuthToken)
+def token_changed(sender, **kwargs):
+    authentication.invalidate(kwargs["instance"].secret)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+#
+# Copyright 2017-present Linaro Limited
+#
+# Author: Rémi Duraffort <remi.duraffort@linaro.org>
+#
+# SPDX-License-Identifier: MIT
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import urlencode
+
+import math
+import time
+
+SALT = "Artifactorial.signing.download"
+UPLOAD_SALT = "Artifactorial.signing.upload"
+
+
+def get_expiration(ttl=None):
+    """
+    Return the expiration timestamp in ttl seconds. It's rounded up to the
+    next minute so the URLs signed in the same minute can be cached together.
+    """
+    if ttl is None:
+        ttl = getattr(settings, "ARTIFACTORIAL_SIGNED_URL_TTL", 60 * 60)
+    return int(math.ceil((time.time() + ttl) / 60.0) * 60)
+
+
+def get_signature(path, expires):
+    """Return the HMAC of the path and expiration, keyed by SECRET_KEY"""
+    return salted_hmac(SALT, "%s:%d" % (path, expires)).hexdigest()
+
+
+def sign(path, ttl=None):
+    """
+    Sign the path for ttl seconds.
+
+    :return: a tuple (expires, signature)
+    """
+    expires = get_expiration(ttl)
+    return (expires, get_signature(path, expires))
+
+
+def get_signed_url(request, path, ttl=None):
+    """Return the absolute signed URL of the artifact path"""
+    expires, signature = sign(path, ttl)
+    return request.build_absolute_uri(
+        "%s?%s"
+        % (
+            reverse("signed", args=[path]),
+            urlencode({"exp": expires, "sig": signature}),
+        )
+    )
+
+
+def get_upload_signature(directory, max_size, expires):
+    """Return the HMAC of the directory path, maximal size and expiration"""
+    value = "%s:%s:%d" % (directory, "" if max_size is None else max_size, expires)
+    return salted_hmac(UPLOAD_SALT, value).hexdigest()
+
+
+def get_upload_url(request, directory, max_size=None, ttl=None):
+    """
+    Return the absolute URL allowing uploads into the directory, for files of
+    at most max_size bytes, without any token.
+    """
+    expires = get_expiration(ttl)
+    query = {"exp": expires}
+    if max_size is not None:
+        query["max_size"] = max_size
+    query["sig"] = get_upload_signature(directory, max_size, expires)
+    return request.build_absolute_uri(
+        "%s?%s"
+        % (reverse("artifacts", args=[directory.lstrip("/") + "/"]), urlencode(query))
+    )
+
+
+def verify_upload(directory, query):
+    """
+    Check the upload signature found in the query string, without accessing
+    the database.
+
+    :return: a tuple (expires, max_size) or None if the signature is invalid
+    """
+    max_size = query.get("max_size", None)
+    try:
+        max_size = None if max_size is None else int(max_size)
+    except ValueError:
+        return None
+    expires = _verify(
+        get_upload_signature,
+        (directory, max_size),
+        query.get("exp", None),
+        query.get("sig", None),
+    )
+    return None if expires is None else (expires, max_size)
+
+
+def verify(path, expires, signature):
+    """
+    Check the signature and the expiration of the path, without accessing
+    the database.
+
+    :return: the expiration timestamp or None if the URL is not valid
+    """
+    return _verify(get_signature, (path,), expires, signature)
+
+
+def _verify(signer, args, expires, signature):
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return None
+    if expires <= time.time():
+        return None
+    if not constant_time_compare(signature or "", signer(*args, expires)):
+        return None
+    return expires
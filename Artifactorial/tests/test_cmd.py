@@ -9,13 +9,24 @@
 
 from django.contrib.auth.models import AnonymousUser, Group, User
 from django.core.management import call_command
+from django.utils import timezone
 
-from Artifactorial.models import Artifact, Directory
+from Artifactorial.models import (
+    Artifact,
+    Directory,
+    PathNode,
+    PendingDeletion,
+    Share,
+)
 
 from datetime import timedelta
+import hashlib
+from io import StringIO
 import os
 import pytest
 import sys
+import time
+from unittest import mock
 
 
 @pytest.fixture
@@ -71,8 +82,7 @@ class TestClean(object):
         assert dir1.artifact_set.count() == 3
         assert dir2.artifact_set.count() == 3
 
-        dir1.ttl = 2
-        dir1.save()
+        Artifact.objects.filter(pk=user1_arts[2].pk).update(expires_at=timezone.now())
         call_command("clean")
         assert dir1.artifact_set.count() == 2
         assert os.path.exists(user1_arts[0].path.path) == True
@@ -109,3 +119,610 @@ class TestClean(object):
         assert os.path.exists(user2_arts[0].path.path) == False
         assert os.path.exists(user2_arts[1].path.path) == False
         assert os.path.exists(user2_arts[2].path.path) == False
+        # Empty folders are removed
+        assert PathNode.objects.count() == 0
+
+    def test_batches(self, users, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        dir1 = Directory.objects.create(path="/pub", ttl=1)
+        dir2 = Directory.objects.create(path="/home/user1", user=users["u"][0], ttl=1)
+        root = media.mkdir("pub")
+        arts = []
+        for index in range(5):
+            f_name = "file%d.txt" % index
+            with open(str(root.join(f_name)), "w") as f_out:
+                f_out.write("0123456789")
+            art = Artifact.objects.create(directory=dir1, path="pub/" + f_name)
+            Artifact.objects.filter(pk=art.pk).update(
+                created_at=art.created_at - timedelta(days=2),
+                expires_at=art.created_at - timedelta(days=1),
+            )
+            arts.append(art)
+        Share.objects.create(artifact=arts[0], user=users["u"][0])
+        # Recent artifact
+        with open(str(root.join("new.txt")), "w") as f_out:
+            f_out.write("0123456789")
+        Artifact.objects.create(directory=dir1, path="pub/new.txt")
+
+        out = StringIO()
+        call_command("clean", dry_run=True, stdout=out)
+        assert out.getvalue() == (
+            "Removing old files in:\n"
+            "* /home/user1: would remove 0 artifacts (0 bytes)\n"
+            "* /pub: would remove 5 artifacts (50 bytes)\n"
+        )
+        assert dir1.artifact_set.count() == 6
+
+        out = StringIO()
+        call_command("clean", time_budget=0, stdout=out)
+        assert out.getvalue() == (
+            "Removing old files in:\n"
+            "* /home/user1: removed 0 artifacts (0 bytes)\n"
+            "Time budget exhausted\n"
+            "Removed 0 pending files\n"
+            "Removed 0 empty folders\n"
+            "Removing empty directories:\n"
+        )
+        assert dir1.artifact_set.count() == 6
+
+        out = StringIO()
+        call_command("clean", batch_size=2, workers=2, stdout=out)
+        assert out.getvalue().startswith(
+            "Removing old files in:\n"
+            "* /home/user1: removed 0 artifacts (0 bytes)\n"
+            "* /pub: removed 5 artifacts (50 bytes)\n"
+            "Removed 0 pending files\n"
+            "Removed 0 empty folders\n"
+        )
+        assert [a.path.name for a in dir1.artifact_set.all()] == ["pub/new.txt"]
+        assert Share.objects.count() == 0
+        assert sorted(os.listdir(str(root))) == ["new.txt"]
+        dir1.refresh_from_db()
+        assert dir1.used_bytes == 10
+        assert dir1.artifact_count == 1
+        node = PathNode.objects.get(path="pub")
+        assert node.size == 10
+        assert node.file_count == 1
+
+    def test_prune(self, db, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        dir1 = Directory.objects.create(path="/pub", ttl=1)
+        media.mkdir("unrelated").mkdir("empty")
+        for name in ["pub/2018/01/a.txt", "pub/2018/02/b.txt", "pub/2019/c.txt"]:
+            media.join(name).write("data", ensure=True)
+            art = Artifact.objects.create(directory=dir1, path=name)
+            if not name.startswith("pub/2019"):
+                Artifact.objects.filter(pk=art.pk).update(
+                    created_at=art.created_at - timedelta(days=2),
+                    expires_at=art.created_at - timedelta(days=1),
+                )
+
+        out = StringIO()
+        call_command("clean", stdout=out)
+        assert out.getvalue() == (
+            "Removing old files in:\n"
+            "* /pub: removed 2 artifacts (8 bytes)\n"
+            "Removed 0 pending files\n"
+            "Removed 3 empty folders\n"
+            "Removing empty directories:\n"
+            "* %s\n"
+            "* %s\n"
+            "* %s\n"
+            % (
+                media.join("pub", "2018", "01"),
+                media.join("pub", "2018", "02"),
+                media.join("pub", "2018"),
+            )
+        )
+        assert sorted(os.listdir(str(media))) == ["pub", "unrelated"]
+        assert os.listdir(str(media.join("pub"))) == ["2019"]
+
+        # Walk the whole MEDIA_ROOT
+        out = StringIO()
+        call_command("clean", full_prune=True, stdout=out)
+        assert out.getvalue().endswith(
+            "Removing empty directories:\n* %s\n* %s\n"
+            % (media.join("unrelated", "empty"), media.join("unrelated"))
+        )
+        assert os.listdir(str(media)) == ["pub"]
+
+
+class TestExpire(object):
+    # Closing the connection would break the transaction of the test
+    @mock.patch("Artifactorial.management.commands.expire.close_old_connections")
+    def test_expire(self, close, users, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        dir1 = Directory.objects.create(path="/pub", ttl=1)
+        now = timezone.now()
+        for index, name in enumerate(
+            ["pub/1/a.txt", "pub/1/b.txt", "pub/2/c.txt", "pub/3/d.txt"]
+        ):
+            media.join(name).write("data", ensure=True)
+            art = Artifact.objects.create(directory=dir1, path=name)
+            Artifact.objects.filter(pk=art.pk).update(
+                expires_at=now + timedelta(minutes=index - 2)
+            )
+        Share.objects.create(artifact=art, user=users["u"][0])
+        # Permanent artifacts never expire
+        media.join("pub", "4", "e.txt").write("data", ensure=True)
+        Artifact.objects.create(directory=dir1, path="pub/4/e.txt", is_permanent=True)
+
+        out = StringIO()
+        call_command("expire", batch_size=2, once=True, stdout=out)
+        assert out.getvalue() == (
+            "Removed 2 artifacts (8 bytes)\n" "Removed 1 artifacts (4 bytes)\n"
+        )
+        assert [a.path.name for a in Artifact.objects.order_by("path")] == [
+            "pub/3/d.txt",
+            "pub/4/e.txt",
+        ]
+        assert sorted(os.listdir(str(media.join("pub")))) == ["3", "4"]
+        assert Share.objects.count() == 1
+        dir1.refresh_from_db()
+        assert dir1.used_bytes == 8
+        assert dir1.artifact_count == 2
+
+        # Nothing to remove
+        out = StringIO()
+        call_command("expire", once=True, stdout=out)
+        assert out.getvalue() == ""
+
+    def test_drain(self, transactional_db, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        settings.ARTIFACTORIAL_INLINE_DELETION = False
+        directory = Directory.objects.create(path="/pub")
+        for name in ["pub/1/a.txt", "pub/1/b.txt", "pub/2/c.txt"]:
+            media.join(name).write("data", ensure=True)
+            Artifact.objects.create(directory=directory, path=name)
+
+        # Removing the directory does not touch the files
+        directory.delete()
+        assert PendingDeletion.objects.count() == 3
+        assert sorted(os.listdir(str(media.join("pub")))) == ["1", "2"]
+
+        out = StringIO()
+        call_command("expire", batch_size=2, once=True, stdout=out)
+        assert out.getvalue() == "Removed 3 pending files\n"
+        assert PendingDeletion.objects.count() == 0
+        assert os.listdir(str(media)) == []
+
+    def test_database_errors(self, db):
+        from django.db import OperationalError
+        from Artifactorial.management.commands import expire
+
+        err = StringIO()
+        with mock.patch.object(
+            expire.Command, "expire", side_effect=[OperationalError("gone"), 0]
+        ), mock.patch.object(expire, "close_old_connections") as close, mock.patch(
+            "time.sleep", side_effect=[None, KeyboardInterrupt]
+        ):
+            with pytest.raises(KeyboardInterrupt):
+                call_command("expire", stdout=StringIO(), stderr=err)
+        # The worker carries on with a new connection
+        assert err.getvalue() == "Database error: gone\n"
+        assert close.call_count == 3
+
+
+class TestPurge(object):
+    def test_purge(self, users, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        pub = Directory.objects.create(path="/pub")
+        sub = Directory.objects.create(path="/pub/sub")
+        for directory, name in [
+            (pub, "pub/a.txt"),
+            (sub, "pub/sub/1/b.txt"),
+            (sub, "pub/sub/1/c.txt"),
+            (sub, "pub/sub/d.txt"),
+        ]:
+            media.join(name).write("data", ensure=True)
+            art = Artifact.objects.create(directory=directory, path=name)
+        Share.objects.create(artifact=art, user=users["u"][0])
+
+        # Nothing scheduled
+        out = StringIO()
+        call_command("purge", stdout=out)
+        assert out.getvalue() == "Purging directories:\nRemoving empty directories:\n"
+
+        sub.schedule_purge()
+        out = StringIO()
+        call_command("purge", time_budget=0, stdout=out)
+        assert out.getvalue() == (
+            "Purging directories:\n"
+            "* /pub/sub: removed 0 artifacts (0 bytes)\n"
+            "Time budget exhausted\n"
+            "Removing empty directories:\n"
+        )
+        assert Directory.objects.filter(path="/pub/sub").exists()
+
+        out = StringIO()
+        call_command("purge", batch_size=2, stdout=out)
+        assert out.getvalue() == (
+            "Purging directories:\n"
+            "* /pub/sub: removed 3 artifacts (12 bytes)\n"
+            "Removing empty directories:\n"
+            "* %s\n"
+            "* %s\n" % (media.join("pub", "sub", "1"), media.join("pub", "sub"))
+        )
+        assert [d.path for d in Directory.objects.all()] == ["/pub"]
+        assert [a.path.name for a in Artifact.objects.all()] == ["pub/a.txt"]
+        assert Share.objects.count() == 0
+        assert PendingDeletion.objects.count() == 0
+        assert os.listdir(str(media.join("pub"))) == ["a.txt"]
+        node = PathNode.objects.get(path="pub")
+        assert node.size == 4
+        assert node.file_count == 1
+
+
+class TestFsck(object):
+    def test_fsck(self, db, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        pub = Directory.objects.create(path="/pub")
+        old = time.time() - 7200
+        for name in ["pub/a.txt", "pub/b/c.txt", "pub-x.txt", "pub/d.txt"]:
+            media.join(name).write("data", ensure=True)
+            Artifact.objects.create(directory=pub, path=name)
+        # Orphan files, a recent one and an upload in progress
+        for name in ["pub/b/orphan.txt", "pub/sub/orphan.txt", "pub/e.txt"]:
+            media.join(name).write("data", ensure=True)
+            os.utime(str(media.join(name)), (old, old))
+        media.join("pub", "recent.txt").write("data")
+        media.join("pub", ".upload-1234").write("data")
+        # Missing files
+        os.unlink(str(media.join("pub", "d.txt")))
+        os.unlink(str(media.join("pub-x.txt")))
+
+        out = StringIO()
+        call_command("fsck", stdout=out)
+        assert out.getvalue() == (
+            "Missing file: pub-x.txt\n"
+            "Orphan file: pub/b/orphan.txt\n"
+            "Missing file: pub/d.txt\n"
+            "Orphan file: pub/e.txt\n"
+            "Orphan file: pub/sub/orphan.txt\n"
+            "Checked 6 files and 4 artifacts: 3 orphan files, 2 missing files\n"
+        )
+        assert Artifact.objects.count() == 4
+
+        # Resume after the checkpoint
+        checkpoint = str(tmpdir.join("checkpoint"))
+        with open(checkpoint, "w") as f_out:
+            f_out.write("pub/b/c.txt")
+        out = StringIO()
+        call_command("fsck", prefix="/pub/", checkpoint=checkpoint, stdout=out)
+        assert out.getvalue() == (
+            "Resuming after pub/b/c.txt\n"
+            "Orphan file: pub/b/orphan.txt\n"
+            "Missing file: pub/d.txt\n"
+            "Orphan file: pub/e.txt\n"
+            "Orphan file: pub/sub/orphan.txt\n"
+            "Checked 4 files and 1 artifacts: 3 orphan files, 1 missing files\n"
+        )
+        assert not os.path.exists(checkpoint)
+
+        out = StringIO()
+        call_command("fsck", prefix="pub", repair=True, stdout=out)
+        assert out.getvalue().endswith(
+            "Checked 6 files and 3 artifacts: 3 orphan files, 1 missing files\n"
+        )
+        assert sorted(a.path.name for a in Artifact.objects.all()) == [
+            "pub-x.txt",
+            "pub/a.txt",
+            "pub/b/c.txt",
+        ]
+        assert sorted(os.listdir(str(media.join("pub")))) == [
+            ".upload-1234",
+            "a.txt",
+            "b",
+            "recent.txt",
+        ]
+        assert os.listdir(str(media.join("pub", "b"))) == ["c.txt"]
+        pub.refresh_from_db()
+        assert pub.artifact_count == 3
+        assert pub.used_bytes == 12
+
+        out = StringIO()
+        call_command("fsck", prefix="pub", stdout=out)
+        assert out.getvalue() == (
+            "Checked 3 files and 2 artifacts: 0 orphan files, 0 missing files\n"
+        )
+
+    def test_fsck_errors(self, db, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        pub = Directory.objects.create(path="/pub")
+        for name in ["pub/a.txt", "pub/sub/b.txt"]:
+            media.join(name).write("data", ensure=True)
+            Artifact.objects.create(directory=pub, path=name)
+
+        # The prefix is a file
+        out, err = (StringIO(), StringIO())
+        call_command("fsck", prefix="pub/a.txt", stdout=out, stderr=err)
+        assert err.getvalue().startswith(
+            "Unable to list %s/: [Errno 20] Not a directory"
+            % media.join("pub", "a.txt")
+        )
+
+        # The artifacts of the directories that cannot be listed are kept
+        scandir = os.scandir
+
+        def unreadable(path):
+            if path.endswith("/sub/"):
+                raise PermissionError(13, "Permission denied")
+            return scandir(path)
+
+        out, err = (StringIO(), StringIO())
+        with mock.patch("os.scandir", unreadable):
+            call_command("fsck", repair=True, stdout=out, stderr=err)
+        assert out.getvalue() == (
+            "Checked 1 files and 2 artifacts: 0 orphan files, 0 missing files\n"
+        )
+        sub = media.join("pub", "sub")
+        assert err.getvalue() == "Unable to list %s/: [Errno 13] %s\n" % (
+            sub,
+            "Permission denied",
+        )
+        assert Artifact.objects.count() == 2
+
+    def test_fsck_concurrent_uploads(self, db, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        pub = Directory.objects.create(path="/pub")
+        media.join("pub", "a.txt").write("data", ensure=True)
+        Artifact.objects.create(directory=pub, path="pub/a.txt")
+        Artifact.objects.create(directory=pub, path="pub/b.txt", size=4)
+
+        # Uploads finishing just after the listing of the folder
+        from Artifactorial.management.commands import fsck
+
+        original = fsck.list_directory
+
+        def list_directory(path, errors):
+            entries = original(path, errors)
+            if path.endswith("/pub/"):
+                media.join("pub", "b.txt").write("data")
+                Artifact.objects.create(directory=pub, path="pub/c.txt", size=4)
+            return entries
+
+        with mock.patch.object(fsck, "list_directory", list_directory):
+            out = StringIO()
+            call_command("fsck", prefix="pub", repair=True, stdout=out)
+        assert out.getvalue() == (
+            "Checked 1 files and 2 artifacts: 0 orphan files, 0 missing files\n"
+        )
+        assert Artifact.objects.count() == 3
+
+
+class TestScrub(object):
+    def test_scrub(self, db, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        pub = Directory.objects.create(path="/pub")
+        arts = {}
+        for name in ["ok.txt", "corrupted.txt", "truncated.txt", "missing.txt"]:
+            media.join("pub", name).write("0123456789", ensure=True)
+            art = Artifact.objects.create(directory=pub, path="pub/" + name)
+            art.md5, art.sha256 = art.compute_digests()
+            art.save()
+            arts[name] = art
+        # Older artifact without digests
+        media.join("pub", "old.txt").write("data")
+        arts["old.txt"] = Artifact.objects.create(directory=pub, path="pub/old.txt")
+        # Recently verified
+        media.join("pub", "recent.txt").write("data")
+        arts["recent.txt"] = Artifact.objects.create(
+            directory=pub, path="pub/recent.txt", last_verified_at=timezone.now()
+        )
+        media.join("pub", "corrupted.txt").write("0123456780")
+        media.join("pub", "truncated.txt").write("01234")
+        os.unlink(str(media.join("pub", "missing.txt")))
+
+        out = StringIO()
+        call_command("scrub", batch_size=2, stdout=out)
+        assert out.getvalue() == (
+            "Corrupted file: pub/corrupted.txt (digests)\n"
+            "Corrupted file: pub/truncated.txt (5 bytes instead of 10)\n"
+            "Missing file: pub/missing.txt\n"
+            "Verified 2 artifacts (14 bytes): 2 corrupted, 1 missing\n"
+        )
+        for name, verified in [
+            ("ok.txt", True),
+            ("corrupted.txt", False),
+            ("truncated.txt", False),
+            ("missing.txt", False),
+            ("old.txt", True),
+        ]:
+            art = Artifact.objects.get(pk=arts[name].pk)
+            assert (art.last_verified_at is not None) == verified
+        art = Artifact.objects.get(pk=arts["old.txt"].pk)
+        assert art.md5 == hashlib.md5(b"data").hexdigest()
+        assert art.sha256 == hashlib.sha256(b"data").hexdigest()
+
+        # Only the failures are checked again, with a limited bandwidth
+        out = StringIO()
+        with mock.patch("time.sleep") as sleep:
+            call_command("scrub", bandwidth=0.000001, stdout=out)
+        assert out.getvalue().endswith(
+            "Verified 0 artifacts (0 bytes): 2 corrupted, 1 missing\n"
+        )
+        assert sleep.call_count == 1
+
+        out = StringIO()
+        call_command("scrub", min_age=0, time_budget=0, stdout=out)
+        assert out.getvalue() == (
+            "Verified 0 artifacts (0 bytes): 0 corrupted, 0 missing\n"
+        )
+
+    def test_throttle(self):
+        from Artifactorial.management.commands.scrub import Throttle
+
+        with mock.patch("time.monotonic", return_value=100.0) as monotonic:
+            throttle = Throttle(1000)
+            with mock.patch("time.sleep") as sleep:
+                throttle(500)
+                sleep.assert_called_once_with(0.5)
+
+                # The credit accumulated while not reading is capped to one
+                # second of reading
+                monotonic.return_value = 110.5
+                sleep.reset_mock()
+                throttle(1000)
+                assert sleep.call_count == 0
+                throttle(2000)
+                sleep.assert_called_once_with(2.0)
+
+
+class TestBackfillDigests(object):
+    def test_backfill(self, users, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        d = Directory.objects.create(path="/pub", is_public=True)
+        root = media.mkdir("pub")
+
+        arts = []
+        for f_name in ["file1.txt", "file2.txt", "file3.txt"]:
+            with open(str(root.join(f_name)), "w") as f_out:
+                f_out.write("some sort of test data")
+            arts.append(Artifact.objects.create(directory=d, path="pub/" + f_name))
+        # Already computed
+        arts[2].md5 = "0" * 32
+        arts[2].sha256 = "0" * 64
+        arts[2].save()
+        # Missing file
+        art = Artifact.objects.create(directory=d, path="pub/missing.txt")
+
+        call_command("backfill_digests", workers=2, batch_size=1)
+        for art in arts[:2]:
+            art.refresh_from_db()
+            assert art.md5 == "600ae9d6304b5d939e3dc10191536c58"
+            assert (
+                art.sha256
+                == "06acb06a07622a998c7af13e19ce5a5991c53d534cb5cc47ea487b262670d38f"
+            )
+        arts[2].refresh_from_db()
+        assert arts[2].md5 == "0" * 32
+        assert arts[2].sha256 == "0" * 64
+        assert Artifact.objects.get(path="pub/missing.txt").sha256 == ""
+
+
+class TestBackfillMetadata(object):
+    def test_backfill(self, users, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        d = Directory.objects.create(path="/pub", is_public=True)
+        root = media.mkdir("pub")
+
+        for f_name, content in [("file1.txt", "one"), ("file2.jpg", "three")]:
+            with open(str(root.join(f_name)), "w") as f_out:
+                f_out.write(content)
+            Artifact.objects.create(directory=d, path="pub/" + f_name)
+        Artifact.objects.create(directory=d, path="pub/missing.txt")
+        # Simulate artifacts created before the metadata were stored
+        Artifact.objects.update(size=None, content_type="", stored_at=None)
+
+        call_command("backfill_metadata", batch_size=1)
+        art1 = Artifact.objects.get(path="pub/file1.txt")
+        assert art1.size == 3
+        assert art1.content_type == "text/plain"
+        assert art1.stored_at.timestamp() == pytest.approx(
+            os.stat(art1.path.path).st_mtime
+        )
+        art2 = Artifact.objects.get(path="pub/file2.jpg")
+        assert art2.size == 5
+        assert art2.content_type == "image/jpeg"
+        missing = Artifact.objects.get(path="pub/missing.txt")
+        assert missing.size is None
+        assert missing.stored_at is None
+        assert d.size() == 8
+
+
+class TestRecomputeUsage(object):
+    def test_recompute(self, users, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        dir1 = Directory.objects.create(path="/pub", is_public=True)
+        dir2 = Directory.objects.create(path="/home/user1", user=users["u"][0])
+        root = media.mkdir("pub")
+        for f_name in ["file1.txt", "file2.txt"]:
+            with open(str(root.join(f_name)), "w") as f_out:
+                f_out.write("0123456789")
+            Artifact.objects.create(directory=dir1, path="pub/" + f_name)
+
+        Directory.objects.update(used_bytes=42, artifact_count=42)
+        out = StringIO()
+        call_command("recompute_usage", stdout=out)
+        assert out.getvalue() == (
+            "Recomputing usage of:\n"
+            "* /home/user1: fixed (42 bytes, 42 artifacts => 0 bytes, 0 artifacts)\n"
+            "* /pub: fixed (42 bytes, 42 artifacts => 20 bytes, 2 artifacts)\n"
+        )
+        dir1.refresh_from_db()
+        assert dir1.used_bytes == 20
+        assert dir1.artifact_count == 2
+
+        out = StringIO()
+        call_command("recompute_usage", stdout=out)
+        assert out.getvalue() == (
+            "Recomputing usage of:\n" "* /home/user1: ok\n" "* /pub: ok\n"
+        )
+
+
+class TestRebuildTree(object):
+    def test_rebuild(self, users, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        dir1 = Directory.objects.create(path="/pub", is_public=True)
+        root = media.mkdir("pub")
+        root.mkdir("2018")
+        for f_name in ["file1.txt", "2018/file2.txt", "2018/file3.txt"]:
+            with open(str(root.join(f_name)), "w") as f_out:
+                f_out.write("0123456789")
+            Artifact.objects.create(directory=dir1, path="pub/" + f_name)
+        dir2 = Directory.objects.create(path="/home/user1", user=users["u"][0])
+        media.join("home", "user1", "a.txt").write("data", ensure=True)
+        Artifact.objects.create(directory=dir2, path="home/user1/a.txt")
+        expected = list(
+            PathNode.objects.order_by("path").values_list(
+                "path", "parent__path", "name", "size", "file_count"
+            )
+        )
+        # The folders above the directories are not counting their artifacts
+        assert expected == [
+            ("home", None, "home", 0, 0),
+            ("home/user1", "home", "user1", 4, 1),
+            ("pub", None, "pub", 30, 3),
+            ("pub/2018", "pub", "2018", 20, 2),
+        ]
+
+        PathNode.objects.update(size=0, file_count=0)
+        out = StringIO()
+        call_command("rebuild_tree", stdout=out)
+        assert out.getvalue() == "Tree rebuilt with 4 folders\n"
+        assert (
+            list(
+                PathNode.objects.order_by("path").values_list(
+                    "path", "parent__path", "name", "size", "file_count"
+                )
+            )
+            == expected
+        )
+        assert [
+            (a.path.name, a.node.path)
+            for a in Artifact.objects.order_by("path").select_related("node")
+        ] == [
+            ("home/user1/a.txt", "home/user1"),
+            ("pub/2018/file2.txt", "pub/2018"),
+            ("pub/2018/file3.txt", "pub/2018"),
+            ("pub/file1.txt", "pub"),
+        ]
+
+        # The folders above the directories are not removed
+        out = StringIO()
+        call_command("clean", stdout=out)
+        assert "Removed 0 empty folders\n" in out.getvalue()
+        assert PathNode.objects.count() == 4
@@ -8,18 +8,33 @@
 # SPDX-License-Identifier: MIT
 
 from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
+from Artifactorial import authentication, signing
 from Artifactorial.models import Artifact, AuthToken, Directory, Share
 
 import base64
 import binascii
 from datetime import timedelta
+import hashlib
+import io
+import json
 import os
 import pytest
 import re
 import sys
+import threading
+import time
+from unittest import mock
+import yaml
 
 
 @pytest.fixture
@@ -35,6 +50,19 @@ def users(db):
     return {"u": [user1, user2, user3], "g": [group1, group2]}
 
 
+@pytest.fixture
+def public_artifact(settings, tmpdir, users):
+    media = tmpdir.mkdir("media")
+    filename = str(media.mkdir("pub").join("data.txt"))
+    with open(filename, "w") as f_out:
+        f_out.write("0123456789abcdefghij")
+    settings.MEDIA_ROOT = str(media)
+    d = Directory.objects.create(path="/pub", is_public=True)
+    art = Artifact.objects.create(path="pub/data.txt", directory=d)
+    share = Share.objects.create(artifact=art, user=users["u"][0])
+    return (art, share)
+
+
 class TestHTTPCode(object):
     def test_empty_get(self, client, db):
         response = client.get(reverse("home"))
@@ -103,13 +131,17 @@ class TestDirectories(object):
             path="/home/user3", user=users["u"][2], is_public=False
         )
 
-        response = client.get(reverse("directories.index"))
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse("directories.index"))
         assert response.status_code == 200
         assert len(response.context["directories"]) == 2
         assert response.context["directories"][0][0].path == "/home/user1"
         assert response.context["directories"][0][1] == False
         assert response.context["directories"][1][0].path == "/home/user2"
         assert response.context["directories"][1][1] == False
+        # The directories are loaded once, without a query per directory
+        selects = [q["sql"] for q in queries if "directory" in q["sql"].lower()]
+        assert len(selects) == 1
 
     def test_user1(self, client, db, users):
         Directory.objects.create(path="/home/user1", user=users["u"][0], is_public=True)
@@ -173,6 +205,58 @@ class TestDirectories(object):
         assert response.context["directories"][2][0].path == "/home/user3"
         assert response.context["directories"][2][1] == True
 
+    def test_scheduled_purge(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        sub = Directory.objects.create(path="/pub/sub", is_public=True)
+        for directory, name in [(pub, "pub/a.txt"), (sub, "pub/sub/b.txt")]:
+            media.join(name).write("data", ensure=True)
+            art = Artifact.objects.create(directory=directory, path=name)
+        share = Share.objects.create(artifact=art, user=users["u"][0])
+
+        response = client.get(reverse("artifacts", args=["pub/"]) + "?format=json")
+        etag = response["ETag"]
+        assert json.loads(b"".join(response.streaming_content))["directories"] == [
+            "sub"
+        ]
+
+        stale = Directory.objects.get(pk=sub.pk)
+        sub.schedule_purge()
+        # The directory and its artifacts are hidden
+        response = client.get(reverse("directories.index"))
+        assert [d.path for (d, _) in response.context["directories"]] == ["/pub"]
+        response = client.get(
+            reverse("artifacts", args=["pub/"]) + "?format=json",
+            HTTP_IF_NONE_MATCH=etag,
+        )
+        assert response.status_code == 200
+        data = json.loads(b"".join(response.streaming_content))
+        assert data["directories"] == []
+        assert data["files"] == [{"path": "a.txt", "size": 4}]
+        assert client.get(reverse("artifacts", args=["pub/sub/"])).status_code == 404
+        for method in [client.get, client.head, client.delete]:
+            response = method(reverse("artifacts", args=["pub/sub/b.txt"]))
+            assert response.status_code == 404
+        assert client.get(reverse("shares", args=[share.token])).status_code == 404
+        # No uploads
+        response = client.post(
+            reverse("artifacts", args=["pub/sub"]),
+            {"path": SimpleUploadedFile("c.txt", b"data")},
+        )
+        assert response.status_code == 404
+        response = client.put(
+            reverse("artifacts", args=["pub/sub/c.txt"]),
+            data=b"data",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 404
+
+        # Saving an outdated instance does not cancel the purge
+        stale.ttl = 3
+        stale.save()
+        assert Directory.objects.get(path="/pub/sub").is_deleting == True
+
 
 class TestShares(object):
     def test_invalid_verbs(self, client):
@@ -365,6 +449,83 @@ class TestTokens(object):
         assert AuthToken.objects.get(user=users["u"][2]) == t3
 
 
+class TestTokenAuthentication(object):
+    def test_header(self, client, users):
+        Directory.objects.create(path="/home/user1", user=users["u"][0])
+        AuthToken.objects.create(user=users["u"][0], secret="123456")
+        url = reverse("artifacts", args=["home/user1/"])
+
+        response = client.get(url)
+        assert response.status_code == 404
+        assert "Authorization" in response["Vary"]
+        response = client.get(url, HTTP_AUTHORIZATION="Token 654321")
+        assert response.status_code == 404
+        response = client.get(url, HTTP_AUTHORIZATION="Token 123456")
+        assert response.status_code == 200
+        assert "Authorization" in response["Vary"]
+        # The query string is still supported
+        response = client.get(url + "?token=123456")
+        assert response.status_code == 200
+
+    def test_cache(self, client, settings, users, django_assert_num_queries):
+        settings.ARTIFACTORIAL_TOKEN_CACHE_TTL = 60
+        settings.ARTIFACTORIAL_TOKEN_CACHE_SIZE = 2
+        authentication.clear()
+        tokens = [
+            AuthToken.objects.create(user=users["u"][i], secret="%d" % i)
+            for i in range(3)
+        ]
+        try:
+            with django_assert_num_queries(1):
+                assert authentication.get_user("0") == users["u"][0]
+                assert authentication.get_user("0") == users["u"][0]
+            with django_assert_num_queries(1):
+                assert authentication.get_user("unknown") is None
+            # Least recently used tokens are evicted
+            authentication.get_user("1")
+            authentication.get_user("2")
+            with django_assert_num_queries(1):
+                assert authentication.get_user("0") == users["u"][0]
+
+            # Removing the token invalidates the cache
+            tokens[0].delete()
+            assert authentication.get_user("0") is None
+            # Expired tokens are reloaded
+            settings.ARTIFACTORIAL_TOKEN_CACHE_TTL = 0.01
+            authentication.get_user("1")
+            time.sleep(0.02)
+            with django_assert_num_queries(1):
+                assert authentication.get_user("1") == users["u"][1]
+        finally:
+            authentication.clear()
+
+    def test_shared_cache(self, client, settings, users, django_assert_num_queries):
+        settings.ARTIFACTORIAL_TOKEN_CACHE_TTL = 60
+        settings.ARTIFACTORIAL_TOKEN_CACHE = "tokens"
+        settings.CACHES = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "tokens": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "tokens",
+            },
+        }
+        authentication.clear()
+        token = AuthToken.objects.create(user=users["u"][0], secret="0")
+        try:
+            assert authentication.get_user("0") == users["u"][0]
+            # Another process would use the shared cache
+            authentication.clear()
+            with django_assert_num_queries(0):
+                assert authentication.get_user("0") == users["u"][0]
+
+            token.delete()
+            authentication.clear()
+            assert authentication.get_user("0") is None
+        finally:
+            authentication.clear()
+            caches["tokens"].clear()
+
+
 class TestPostingArtifacts(object):
     def test_push_non_existent_directory(self, client, settings, tmpdir, users):
         media = tmpdir.mkdir("media")
@@ -418,6 +579,89 @@ class TestPostingArtifacts(object):
             )
         assert response.status_code == 200
 
+    def test_quota_before_body(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        filename = str(tmpdir.join("data.txt"))
+        with open(filename, "w") as f_out:
+            f_out.write("Hello World!!!")
+        settings.MEDIA_ROOT = str(media)
+        d = Directory.objects.create(path="/pub", quota=20)
+
+        # The Content-Length (with the multipart framing) is larger than the
+        # quota, but the file fits
+        with open(filename, "r") as f_in:
+            response = client.post(reverse("artifacts", args=["pub"]), {"path": f_in})
+        assert response.status_code == 200
+        Artifact.objects.all().delete()
+
+        # Rejected without reading the body when no overhead is allowed
+        settings.ARTIFACTORIAL_UPLOAD_OVERHEAD = 0
+        with mock.patch(
+            "Artifactorial.uploadhandlers.DigestUploadHandler.receive_data_chunk"
+        ) as receive:
+            with open(filename, "r") as f_in:
+                response = client.post(
+                    reverse("artifacts", args=["pub"]),
+                    {"path": f_in},
+                    HTTP_EXPECT="100-continue",
+                )
+        assert response.status_code == 403
+        assert receive.call_count == 0
+        assert Artifact.objects.count() == 0
+
+    def test_quota_while_receiving(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        filename = str(tmpdir.join("data.bin"))
+        with open(filename, "wb") as f_out:
+            f_out.write(os.urandom(200 * 1024))
+        settings.MEDIA_ROOT = str(media)
+        d = Directory.objects.create(path="/pub", quota=150 * 1024)
+
+        # Stopped after receiving the first chunks
+        with open(filename, "rb") as f_in:
+            response = client.post(reverse("artifacts", args=["pub"]), {"path": f_in})
+        assert response.status_code == 403
+        assert Artifact.objects.count() == 0
+        d.refresh_from_db()
+        assert d.reserved_bytes == 0
+        assert d.used_bytes == 0
+
+    @pytest.mark.django_db(transaction=True)
+    def test_concurrent_quota(self, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        filename = str(tmpdir.join("data.txt"))
+        with open(filename, "w") as f_out:
+            f_out.write("0123456789")
+        settings.MEDIA_ROOT = str(media)
+        d = Directory.objects.create(path="/pub", quota=50)
+
+        barrier = threading.Barrier(12)
+        results = []
+
+        def upload():
+            try:
+                barrier.wait()
+                with open(filename, "r") as f_in:
+                    response = Client().post(
+                        reverse("artifacts", args=["pub"]), data={"path": f_in}
+                    )
+                results.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=upload) for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results.count(200) == 5
+        assert results.count(403) == 7
+        d.refresh_from_db()
+        assert d.used_bytes == 50
+        assert d.artifact_count == 5
+        assert d.reserved_bytes == 0
+
     def test_group_write(self, client, settings, tmpdir, users):
         media = tmpdir.mkdir("media")
         filename = str(tmpdir.join("data.txt"))
@@ -542,6 +786,232 @@ class TestPostingArtifacts(object):
         content = response.content
         assert content == b"http://testserver/artifacts/pub/data.txt"
 
+    def test_ttl(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        d = Directory.objects.create(path="/pub", ttl=10)
+        url = reverse("artifacts", args=["pub"])
+
+        for ttl in ["0", "-1", "11", "abc"]:
+            response = client.post(
+                url, {"path": SimpleUploadedFile("a.txt", b"data"), "ttl": ttl}
+            )
+            assert response.status_code == 400
+        assert d.artifact_set.count() == 0
+        d.refresh_from_db()
+        assert d.reserved_bytes == 0
+
+        before = timezone.now()
+        response = client.post(url, {"path": SimpleUploadedFile("a.txt", b"data")})
+        assert response.status_code == 200
+        response = client.post(
+            url, {"path": SimpleUploadedFile("b.txt", b"data"), "ttl": "2"}
+        )
+        assert response.status_code == 200
+        response = client.put(
+            reverse("artifacts", args=["pub/c.txt"]) + "?ttl=3",
+            data=b"data",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 201
+        response = client.put(
+            reverse("artifacts", args=["pub/d.txt"]) + "?ttl=30",
+            data=b"data",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 400
+        after = timezone.now()
+
+        for name, ttl in [("a.txt", 10), ("b.txt", 2), ("c.txt", 3)]:
+            art = Artifact.objects.get(path__endswith="/" + name)
+            assert before + timedelta(days=ttl) <= art.expires_at
+            assert art.expires_at <= after + timedelta(days=ttl)
+
+
+class TestPuttingArtifacts(object):
+    def test_put(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        d = Directory.objects.create(path="/home/user1", user=users["u"][0])
+        AuthToken.objects.create(user=users["u"][0], secret="123456")
+
+        # Anonymous user
+        response = client.put(
+            reverse("artifacts", args=["home/user1/data.txt"]),
+            data=b"Hello World!!!",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 403
+        # Unknown directory
+        response = client.put(
+            reverse("artifacts", args=["home/user2/data.txt"]) + "?token=123456",
+            data=b"Hello World!!!",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 404
+        # Not on directories
+        response = client.put(
+            reverse("artifacts", args=["home/user1/"]) + "?token=123456",
+            data=b"Hello World!!!",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 405
+
+        response = client.put(
+            reverse("artifacts", args=["home/user1/data.txt"]) + "?token=123456",
+            data=b"Hello World!!!",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 201
+        content = response.content.decode("utf-8")
+        assert content.startswith("http://testserver/artifacts/home/user1/")
+        assert content.endswith("/data.txt")
+
+        artifact = Artifact.objects.get(directory=d)
+        assert artifact.is_permanent is False
+        assert artifact.size == 14
+        assert artifact.md5 == hashlib.md5(b"Hello World!!!").hexdigest()
+        assert artifact.sha256 == hashlib.sha256(b"Hello World!!!").hexdigest()
+        assert artifact.content_type == "text/plain"
+        with open(artifact.path.path, "rb") as f_in:
+            assert f_in.read() == b"Hello World!!!"
+        # Only the final file remains
+        assert os.listdir(os.path.dirname(artifact.path.path)) == ["data.txt"]
+
+        d.refresh_from_db()
+        assert d.used_bytes == 14
+        assert d.artifact_count == 1
+        assert d.reserved_bytes == 0
+
+        # Same name: the file is not overwritten
+        response = client.put(
+            reverse("artifacts", args=["home/user1/data.txt"])
+            + "?token=123456&is_permanent=1",
+            data=b"Hello!!!",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 201
+        assert response.content == b"http://testserver/artifacts/home/user1/data.txt"
+        response = client.put(
+            reverse("artifacts", args=["home/user1/data.txt"])
+            + "?token=123456&is_permanent=1",
+            data=b"Hello!!!",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 201
+        assert response.content != b"http://testserver/artifacts/home/user1/data.txt"
+        assert Artifact.objects.filter(directory=d, is_permanent=True).count() == 2
+        with open(artifact.path.path, "rb") as f_in:
+            assert f_in.read() == b"Hello World!!!"
+
+    def test_quota(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        d = Directory.objects.create(path="/pub", quota=20)
+
+        response = client.put(
+            reverse("artifacts", args=["pub/data.txt"]),
+            data=b"Hello World!!!",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 201
+        response = client.put(
+            reverse("artifacts", args=["pub/data.txt"]),
+            data=b"Hello World!!!",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 403
+
+        d.refresh_from_db()
+        assert d.used_bytes == 14
+        assert d.artifact_count == 1
+        assert d.reserved_bytes == 0
+
+    def test_truncated_body(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        d = Directory.objects.create(path="/pub")
+
+        response = client.put(
+            reverse("artifacts", args=["pub/data.txt"]),
+            data=b"Hello World!!!",
+            content_type="application/octet-stream",
+            CONTENT_LENGTH="20",
+            **{"wsgi.input": io.BytesIO(b"Hello World!!!")}
+        )
+        assert response.status_code == 400
+        assert Artifact.objects.count() == 0
+        d.refresh_from_db()
+        assert d.reserved_bytes == 0
+        for _, _, files in os.walk(str(media)):
+            assert files == []
+
+    def test_long_names(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        Directory.objects.create(path="/pub")
+        Directory.objects.create(path="/" + "d" * 99)
+
+        # Truncated like the POST uploads
+        response = client.put(
+            reverse("artifacts", args=["pub/" + "a" * 90 + ".txt"]),
+            data=b"data",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 201
+        path = Artifact.objects.get().path.name
+        assert len(path) <= 100
+        assert path.endswith(".txt")
+
+        # Cannot fit
+        response = client.put(
+            reverse("artifacts", args=["d" * 99 + "/a.txt"]),
+            data=b"data",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 400
+        assert Artifact.objects.count() == 1
+
+    def test_invalid_names(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        Directory.objects.create(path="/pub")
+        Directory.objects.create(path="/pub/sub")
+
+        for name in ["pub/..", "pub/.", "pub/sub/..", "pub/sub/../../etc"]:
+            for query in ["", "?is_permanent=1"]:
+                response = client.put(
+                    reverse("artifacts", args=[name]) + query,
+                    data=b"data",
+                    content_type="application/octet-stream",
+                )
+                assert response.status_code in [400, 404], name
+        # Same for presigned uploads
+        expires = int(time.time()) + 60
+        sig = signing.get_upload_signature("/pub", None, expires)
+        response = client.put(
+            reverse("artifacts", args=["pub/.."]) + "?exp=%d&sig=%s" % (expires, sig),
+            data=b"data",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 400
+        assert Artifact.objects.count() == 0
+        for _, _, files in os.walk(str(media)):
+            assert files == []
+
+        # The directory is still usable
+        response = client.post(
+            reverse("artifacts", args=["pub"]),
+            {"path": SimpleUploadedFile("a.txt", b"data")},
+        )
+        assert response.status_code == 200
+        response = client.put(
+            reverse("artifacts", args=["pub/b.txt"]),
+            data=b"data",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 201
+
 
 @pytest.fixture
 def directories(client, settings, tmpdir, users):
@@ -691,6 +1161,13 @@ class TestGet(object):
         assert ctx["files"] == [("private.iso", 16)]
         assert ctx["token"] == None
 
+        # The size is not read from the filesystem
+        assert private_artifact.size == 16
+        assert private_artifact.content_type == "application/x-iso9660-image"
+        Artifact.objects.filter(pk=private_artifact.pk).update(size=42)
+        response = client.get(reverse("artifacts", args=["home/user1/"]))
+        assert response.context["files"] == [("private.iso", 42)]
+
         # As anonymous
         client.logout()
         response = client.get(reverse("artifacts", args=["home/user1/"]))
@@ -736,6 +1213,275 @@ class TestGet(object):
         assert len(resp) == 1
         assert resp[0] == b"One image"
 
+    def test_listing_entries(self, client, db, django_assert_num_queries):
+        now = timezone.now()
+        d1 = Directory.objects.create(path="/pub", is_public=True)
+        Directory.objects.create(path="/pub/debian", is_public=True)
+        Directory.objects.create(path="/pubx", is_public=True)
+        for i, name in enumerate(
+            [
+                "pub/a.txt",
+                "pub/2018/01/b.txt",
+                "pub/2018/02/c.txt",
+                "pub/2019/d.txt",
+                "pubx/e.txt",
+            ]
+        ):
+            Artifact.objects.create(directory=d1, path=name, size=i, stored_at=now)
+
+        # The number of queries does not depend on the number of artifacts
+        with django_assert_num_queries(5):
+            response = client.get(reverse("artifacts", args=["pub/"]))
+        assert response.status_code == 200
+        ctx = response.context
+        assert ctx["directories"] == ["2018", "2019", "debian"]
+        assert ctx["folders"] == [("2018", 3), ("2019", 3), ("debian", None)]
+        assert ctx["files"] == [("a.txt", 0)]
+
+        response = client.get(reverse("artifacts", args=["pub/2018/"]))
+        assert response.status_code == 200
+        ctx = response.context
+        assert ctx["directories"] == ["01", "02"]
+        assert ctx["folders"] == [("01", 1), ("02", 2)]
+        assert ctx["files"] == []
+
+        response = client.get(reverse("artifacts", args=["pub/2018/01/"]))
+        assert response.status_code == 200
+        ctx = response.context
+        assert ctx["directories"] == []
+        assert ctx["files"] == [("b.txt", 1)]
+
+    def test_pagination(self, client, db, settings):
+        now = timezone.now()
+        d1 = Directory.objects.create(path="/pub", is_public=True)
+        Directory.objects.create(path="/pub/debian", is_public=True)
+        for i, name in enumerate(
+            ["pub/c.txt", "pub/2018/b.txt", "pub/2019/d.txt", "pub/a.txt", "pub/b.txt"]
+        ):
+            Artifact.objects.create(directory=d1, path=name, size=i, stored_at=now)
+
+        # Walk through the pages
+        directories = []
+        files = []
+        url = reverse("artifacts", args=["pub/"]) + "?format=json&limit=2"
+        pages = 0
+        while url is not None:
+            response = client.get(url)
+            assert response.status_code == 200
+            data = json.loads(b"".join(response.streaming_content).decode("utf-8"))
+            assert len(data["directories"]) + len(data["files"]) <= 2
+            directories.extend(data["directories"])
+            files.extend(data["files"])
+            url = data["next"]
+            pages += 1
+        assert pages == 3
+        assert directories == ["2018", "2019", "debian"]
+        assert files == [
+            {"path": "a.txt", "size": 3},
+            {"path": "b.txt", "size": 4},
+            {"path": "c.txt", "size": 0},
+        ]
+
+        # Without limit, everything is returned
+        response = client.get(reverse("artifacts", args=["pub/"]) + "?format=yaml")
+        assert response.status_code == 200
+        content = b"".join(response.streaming_content).decode("utf-8")
+        assert content.endswith("next: null\n")
+
+        # HTML pages are always paginated
+        settings.ARTIFACTORIAL_LISTING_PAGE_SIZE = 4
+        response = client.get(reverse("artifacts", args=["pub/"]))
+        assert response.status_code == 200
+        ctx = response.context
+        assert ctx["directories"] == ["2018", "2019", "debian"]
+        assert ctx["files"] == [("a.txt", 3)]
+        assert ctx["next"] is not None
+        assert b'id="next-page"' in response.content
+        response = client.get(ctx["next"])
+        assert response.status_code == 200
+        ctx = response.context
+        assert ctx["directories"] == []
+        assert ctx["files"] == [("b.txt", 4), ("c.txt", 0)]
+        assert ctx["next"] is None
+
+        # The folders exactly fill the page, followed by a file
+        d2 = Directory.objects.create(path="/tmp", is_public=True)
+        for name in ["tmp/2020/a.txt", "tmp/b.txt"]:
+            Artifact.objects.create(directory=d2, path=name, size=1, stored_at=now)
+        url = reverse("artifacts", args=["tmp/"]) + "?format=json&limit=1"
+        response = client.get(url)
+        assert response.status_code == 200
+        data = json.loads(b"".join(response.streaming_content).decode("utf-8"))
+        assert data["directories"] == ["2020"]
+        assert data["files"] == []
+        response = client.get(data["next"])
+        assert response.status_code == 200
+        data = json.loads(b"".join(response.streaming_content).decode("utf-8"))
+        assert data["directories"] == []
+        assert data["files"] == [{"path": "b.txt", "size": 1}]
+        assert data["next"] is None
+
+        # Invalid parameters
+        url = reverse("artifacts", args=["pub/"])
+        assert client.get(url + "?limit=0").status_code == 400
+        assert client.get(url + "?limit=abc").status_code == 400
+        assert client.get(url + "?marker=abc").status_code == 400
+        assert client.get(url + "?marker=eDpibGE=").status_code == 400
+
+    def test_hidden_sub_directories(self, client, db, users):
+        now = timezone.now()
+        pub = Directory.objects.create(path="/pub", is_public=True)
+        private = Directory.objects.create(
+            path="/pub/2018", user=users["u"][0], is_public=False
+        )
+        hidden = Directory.objects.create(
+            path="/pub/2019", user=users["u"][0], is_public=False
+        )
+        Artifact.objects.create(
+            directory=pub, path="pub/2018/a.txt", size=1, stored_at=now
+        )
+        Artifact.objects.create(
+            directory=hidden, path="pub/2019/b.txt", size=1, stored_at=now
+        )
+        Artifact.objects.create(
+            directory=private, path="pub/2018/c/d.txt", size=1, stored_at=now
+        )
+
+        # The folders with visible artifacts are listed, even in hidden
+        # directories
+        for path, directories, files in [
+            ("pub/", ["2018"], []),
+            ("pub/2018/", [], [{"path": "a.txt", "size": 1}]),
+        ]:
+            response = client.get(
+                reverse("artifacts", args=[path]) + "?format=json&limit=10"
+            )
+            assert response.status_code == 200
+            data = json.loads(b"".join(response.streaming_content).decode("utf-8"))
+            assert data["directories"] == directories
+            assert data["files"] == files
+
+        # The owner sees everything
+        assert client.login(username="user1", password="123456")
+        response = client.get(reverse("artifacts", args=["pub/2018/"]) + "?format=json")
+        data = json.loads(b"".join(response.streaming_content).decode("utf-8"))
+        assert data["directories"] == ["c"]
+        assert data["files"] == [{"path": "a.txt", "size": 1}]
+
+    def test_formats(self, client, db):
+        now = timezone.now()
+        d1 = Directory.objects.create(path="/pub", is_public=True)
+        for i, name in enumerate(["pub/2018/a.txt", 'pub/say "hello".txt', "pub/b: c"]):
+            Artifact.objects.create(directory=d1, path=name, size=i, stored_at=now)
+        url = reverse("artifacts", args=["pub/"])
+
+        response = client.get(url + "?format=json")
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/json"
+        assert json.loads(b"".join(response.streaming_content).decode("utf-8")) == {
+            "directory": "/pub",
+            "directories": ["2018"],
+            "files": [
+                {"path": "b: c", "size": 2},
+                {"path": 'say "hello".txt', "size": 1},
+            ],
+            "next": None,
+        }
+
+        response = client.get(url + "?format=yaml")
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/yaml"
+        assert yaml.safe_load(b"".join(response.streaming_content)) == {
+            "directory": "/pub",
+            "directories": ["2018"],
+            "files": [
+                {"name": "b: c", "size": 2},
+                {"name": 'say "hello".txt', "size": 1},
+            ],
+            "next": None,
+        }
+
+        response = client.get(url + "?format=ndjson&limit=2")
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/x-ndjson"
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        assert [json.loads(line) for line in lines] == [
+            {"type": "directory", "name": "2018", "size": 0},
+            {"type": "file", "name": "b: c", "size": 2},
+        ]
+        assert response["Link"].startswith("<http://testserver/artifacts/pub/?")
+        assert response["Link"].endswith('>; rel="next"')
+
+        # Empty directory
+        Directory.objects.create(path="/empty", is_public=True)
+        response = client.get(reverse("artifacts", args=["empty/"]) + "?format=yaml")
+        assert response.status_code == 200
+        assert yaml.safe_load(b"".join(response.streaming_content)) == {
+            "directory": "/empty",
+            "directories": [],
+            "files": [],
+            "next": None,
+        }
+
+    def test_recursive(self, client, db, users):
+        now = timezone.now()
+        d1 = Directory.objects.create(path="/pub", is_public=True)
+        d2 = Directory.objects.create(
+            path="/pub/private", user=users["u"][0], is_public=False
+        )
+        for i, name in enumerate(["pub/2018/01/a.txt", "pub/2018/b.txt", "pub/c.txt"]):
+            Artifact.objects.create(
+                directory=d1, path=name, size=i, stored_at=now, sha256="%d" % i
+            )
+        Artifact.objects.create(
+            directory=d2, path="pub/private/d.txt", size=3, stored_at=now
+        )
+        url = reverse("artifacts", args=["pub/"])
+
+        assert client.get(url + "?recursive=1").status_code == 400
+        response = client.get(url + "?recursive=1&format=json")
+        assert response.status_code == 200
+        data = json.loads(b"".join(response.streaming_content).decode("utf-8"))
+        assert data["directory"] == "/pub"
+        assert data["next"] is None
+        assert [(a["path"], a["size"], a["sha256"]) for a in data["artifacts"]] == [
+            ("2018/01/a.txt", 0, "0"),
+            ("2018/b.txt", 1, "1"),
+            ("c.txt", 2, "2"),
+        ]
+        assert data["artifacts"][0]["is_permanent"] is False
+        assert data["artifacts"][0]["md5"] is None
+        assert "created_at" in data["artifacts"][0]
+
+        # Pages
+        assert client.login(username="user1", password="123456")
+        response = client.get(url + "?recursive=1&format=ndjson&limit=3")
+        assert response.status_code == 200
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        assert [json.loads(line)["path"] for line in lines] == [
+            "2018/01/a.txt",
+            "2018/b.txt",
+            "c.txt",
+        ]
+        next_url = response["Link"][1 : -len('>; rel="next"')]
+        response = client.get(next_url)
+        assert response.status_code == 200
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        assert [json.loads(line)["path"] for line in lines] == ["private/d.txt"]
+        assert not response.has_header("Link")
+
+        response = client.get(
+            reverse("artifacts", args=["pub/2018/"]) + "?recursive=1&format=yaml"
+        )
+        assert response.status_code == 200
+        data = yaml.safe_load(b"".join(response.streaming_content))
+        assert [a["path"] for a in data["artifacts"]] == ["01/a.txt", "b.txt"]
+
+        response = client.get(
+            reverse("artifacts", args=["missing/"]) + "?recursive=1&format=yaml"
+        )
+        assert response.status_code == 404
+
 
 class TestHead(object):
     def test_public_artifact(self, client, settings, tmpdir, users):
@@ -792,14 +1538,102 @@ class TestHead(object):
         assert response["Content-Type"] == "text/plain"
         assert response["Content-Length"] == "22"
 
+    def test_stored_digests(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        filename = str(tmpdir.join("take_my_sum.txt"))
+        with open(filename, "w") as f_out:
+            f_out.write("some sort of test data")
+        settings.MEDIA_ROOT = str(media)
+        d = Directory.objects.create(path="/pub", is_public=True)
+
+        with open(filename, "r") as f_in:
+            response = client.post(
+                reverse("artifacts", args=["pub"]),
+                data={"path": f_in, "is_permanent": True},
+            )
+        assert response.status_code == 200
+        artifact = Artifact.objects.get(directory=d)
+        assert artifact.md5 == "600ae9d6304b5d939e3dc10191536c58"
+        assert (
+            artifact.sha256
+            == "06acb06a07622a998c7af13e19ce5a5991c53d534cb5cc47ea487b262670d38f"
+        )
+
+        # The file is not read anymore
+        os.unlink(artifact.path.path)
+        with open(artifact.path.path, "w") as f_out:
+            f_out.write("some sort of test DATA")
+        response = client.head(reverse("artifacts", args=["pub/take_my_sum.txt"]))
+        assert response.status_code == 200
+        assert (
+            base64.b64decode(response["Content-MD5"])
+            == b"600ae9d6304b5d939e3dc10191536c58"
+        )
+        sha256 = base64.b64encode(binascii.a2b_hex(artifact.sha256)).decode("ascii")
+        md5 = base64.b64encode(binascii.a2b_hex(artifact.md5)).decode("ascii")
+        assert response["Digest"] == "md5=%s,sha-256=%s" % (md5, sha256)
+        assert response["Repr-Digest"] == "sha-256=:%s:" % sha256
+
+    def test_missing_digests(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        filename = str(media.mkdir("pub").join("take_my_sum.txt"))
+        with open(filename, "w") as f_out:
+            f_out.write("some sort of test data")
+        settings.MEDIA_ROOT = str(media)
+        d = Directory.objects.create(path="/pub", is_public=True)
+        art = Artifact.objects.create(path="pub/take_my_sum.txt", directory=d)
+        assert art.md5 == ""
+        assert art.sha256 == ""
+
+        # The digests are computed and saved on the first request
+        response = client.head(reverse("artifacts", args=["pub/take_my_sum.txt"]))
+        assert response.status_code == 200
+        art.refresh_from_db()
+        assert art.md5 == "600ae9d6304b5d939e3dc10191536c58"
+        assert (
+            art.sha256
+            == "06acb06a07622a998c7af13e19ce5a5991c53d534cb5cc47ea487b262670d38f"
+        )
+
 
 class TestDelete(object):
-    def test_invalid_delete(self, client):
+    def test_invalid_delete(self, client, db):
         assert (
-            client.delete(reverse("artifacts", args=["/home/bla/"])).status_code == 400
+            client.delete(reverse("artifacts", args=["/home/bla/"])).status_code == 404
         )
 
-    def test_private_artifact(self, client, settings, tmpdir, users):
+    def test_directory(self, client, users):
+        staff = User.objects.create_user("staff", "staff@example.com", "123456")
+        staff.is_staff = True
+        staff.save()
+        Directory.objects.create(path="/home/user1", user=users["u"][0])
+        Directory.objects.create(path="/home/grp1", group=users["g"][0])
+        Directory.objects.create(path="/anonymous")
+        AuthToken.objects.create(user=users["u"][1], secret="123456")
+
+        for path, username, token, status in [
+            ("home/user1/", None, None, 403),
+            ("home/user1/", None, "123456", 403),
+            ("home/grp1/", None, "123456", 202),
+            ("anonymous/", "user1", None, 403),
+            ("home/user1/", "user1", None, 202),
+            ("home/user1/", "user1", None, 404),
+            ("anonymous/", "staff", None, 202),
+        ]:
+            client.logout()
+            if username is not None:
+                assert client.login(username=username, password="123456")
+            url = reverse("artifacts", args=[path])
+            if token is not None:
+                url += "?token=" + token
+            assert client.delete(url).status_code == status, path
+        assert list(
+            Directory.objects.filter(is_deleting=True)
+            .order_by("path")
+            .values_list("path", flat=True)
+        ) == ["/anonymous", "/home/grp1", "/home/user1"]
+
+    def test_private_artifact(self, client, settings, tmpdir, transactional_db, users):
         media = tmpdir.mkdir("media")
         settings.MEDIA_ROOT = str(media)
         d1 = Directory.objects.create(path="/private/user1", user=users["u"][0])
@@ -837,7 +1671,9 @@ class TestDelete(object):
         assert Artifact.objects.filter(directory=d1).count() == 0
         assert not os.path.exists(path)
 
-    def test_private_group_artifact(self, client, settings, tmpdir, users):
+    def test_private_group_artifact(
+        self, client, settings, tmpdir, transactional_db, users
+    ):
         media = tmpdir.mkdir("media")
         settings.MEDIA_ROOT = str(media)
         d1 = Directory.objects.create(path="/private/grp1", group=users["g"][0])
@@ -870,7 +1706,9 @@ class TestDelete(object):
         assert Artifact.objects.filter(directory=d1).count() == 0
         assert not os.path.exists(path)
 
-    def test_anonymous_artifact(self, client, settings, tmpdir, users):
+    def test_anonymous_artifact(
+        self, client, settings, tmpdir, transactional_db, users
+    ):
         media = tmpdir.mkdir("media")
         settings.MEDIA_ROOT = str(media)
         d1 = Directory.objects.create(path="/anon", is_public=True)
@@ -897,3 +1735,440 @@ class TestDelete(object):
         assert response.status_code == 200
         assert Artifact.objects.filter(directory=d1).count() == 0
         assert not os.path.exists(path)
+
+
+class TestSignedURLs(object):
+    @pytest.fixture
+    def artifact(self, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        filename = str(media.mkdir("home").mkdir("user1").join("image.iso"))
+        with open(filename, "w") as f_out:
+            f_out.write("some iso data")
+        settings.MEDIA_ROOT = str(media)
+        d = Directory.objects.create(path="/home/user1", user=users["u"][0])
+        AuthToken.objects.create(user=users["u"][0], secret="123456")
+        return Artifact.objects.create(path="home/user1/image.iso", directory=d)
+
+    def test_sign_and_download(
+        self, client, transactional_db, artifact, django_assert_num_queries
+    ):
+        url = reverse("signed.root")
+        assert client.get(url).status_code == 405
+        response = client.put(url, data="path=home/user1/image.iso")
+        assert response.status_code == 403
+        response = client.put(url, data="path=home/user1/missing.iso&token=123456")
+        assert response.status_code == 404
+        response = client.put(url, data="path=home/user1/image.iso&token=123456")
+        assert response.status_code == 200
+        signed_url = response.content.decode("utf-8")
+        assert signed_url.startswith(
+            "http://testserver/signed/home/user1/image.iso?exp="
+        )
+
+        # Downloading does not access the database
+        with django_assert_num_queries(0):
+            response = client.get(signed_url)
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == b"some iso data"
+        cache_control = response["Cache-Control"].split(", ")
+        assert "public" in cache_control
+        max_age = int(
+            [c for c in cache_control if c.startswith("max-age=")][0][len("max-age=") :]
+        )
+        assert 3600 <= max_age <= 3660
+        assert client.head(signed_url).status_code == 200
+        assert client.delete(signed_url).status_code == 405
+
+        # The signature is bound to the path and the expiration
+        query = signed_url.split("?")[1]
+        response = client.get(
+            reverse("signed", args=["home/user1/other.iso"]) + "?" + query
+        )
+        assert response.status_code == 403
+        response = client.get(signed_url.replace("exp=", "exp=1"))
+        assert response.status_code == 403
+        response = client.get(signed_url[:-1])
+        assert response.status_code == 403
+        response = client.get(reverse("signed", args=["home/user1/image.iso"]))
+        assert response.status_code == 403
+
+        # Removed artifacts
+        artifact.delete()
+        assert client.get(signed_url).status_code == 404
+
+    def test_expiration(self, client, artifact):
+        expires = int(time.time()) - 1
+        url = "%s?exp=%d&sig=%s" % (
+            reverse("signed", args=["home/user1/image.iso"]),
+            expires,
+            signing.get_signature("home/user1/image.iso", expires),
+        )
+        assert client.get(url).status_code == 403
+
+        url = reverse("signed.root")
+        for ttl in ["0", "-1", "abc", "604801"]:
+            response = client.put(
+                url, data="path=home/user1/image.iso&token=123456&ttl=" + ttl
+            )
+            assert response.status_code == 400
+        response = client.put(url, data="path=home/user1/image.iso&token=123456&ttl=60")
+        assert response.status_code == 200
+        signed_url = response.content.decode("utf-8")
+        assert client.get(signed_url).status_code == 200
+        with mock.patch("time.time", return_value=time.time() + 121):
+            assert client.get(signed_url).status_code == 403
+
+
+class TestPresignedUploads(object):
+    def test_upload(self, client, settings, tmpdir, users):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        d1 = Directory.objects.create(path="/home/user1", user=users["u"][0])
+        Directory.objects.create(path="/home/user2", user=users["u"][1])
+        AuthToken.objects.create(user=users["u"][0], secret="123456")
+
+        url = reverse("signed.root")
+        response = client.put(url, data="directory=home/user1")
+        assert response.status_code == 403
+        response = client.put(url, data="directory=home/user2&token=123456")
+        assert response.status_code == 403
+        response = client.put(url, data="directory=home/user1&token=123456&max_size=a")
+        assert response.status_code == 400
+        response = client.put(url, data="directory=home/user1&token=123456&max_size=20")
+        assert response.status_code == 200
+        upload_url = response.content.decode("utf-8")
+        assert upload_url.startswith("http://testserver/artifacts/home/user1/?exp=")
+
+        # Upload without token nor authentication query
+        filename = str(tmpdir.join("data.txt"))
+        with open(filename, "w") as f_out:
+            f_out.write("Hello World!!!")
+        with CaptureQueriesContext(connection) as queries:
+            with open(filename, "r") as f_in:
+                response = client.post(upload_url, data={"path": f_in})
+        assert response.status_code == 200
+        assert not [q for q in queries if "authtoken" in q["sql"].lower()]
+        assert d1.artifact_set.count() == 1
+
+        path, query = upload_url.split("?")
+        response = client.put(
+            path + "put.txt?" + query,
+            data=b"Hello World!!!",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 201
+        assert d1.artifact_set.count() == 2
+
+        # Files larger than the declared maximal size
+        with open(filename, "w") as f_out:
+            f_out.write("Hello World!!! Hello World!!!")
+        with open(filename, "r") as f_in:
+            response = client.post(upload_url, data={"path": f_in})
+        assert response.status_code == 403
+        response = client.put(
+            path + "put.txt?" + query,
+            data=b"Hello World!!! Hello World!!!",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 403
+        assert d1.artifact_set.count() == 2
+
+        # The signature is bound to the directory and the maximal size
+        response = client.put(
+            reverse("artifacts", args=["home/user2/put.txt"]) + "?" + query,
+            data=b"Hello",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 403
+        response = client.put(
+            path + "put.txt?" + query.replace("max_size=20", "max_size=200"),
+            data=b"Hello",
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 403
+        with open(filename, "r") as f_in:
+            response = client.post(path + "?" + query[:-1], data={"path": f_in})
+        assert response.status_code == 403
+
+        # Expired URLs
+        with mock.patch("time.time", return_value=time.time() + 3700):
+            response = client.put(
+                path + "put.txt?" + query,
+                data=b"Hello",
+                content_type="application/octet-stream",
+            )
+        assert response.status_code == 403
+        assert d1.artifact_set.count() == 2
+
+
+class TestDownloadBackends(object):
+    def test_django(self, client, settings, public_artifact):
+        settings.ARTIFACTORIAL_DOWNLOAD_BACKEND = "django"
+        for url in [
+            reverse("artifacts", args=["pub/data.txt"]),
+            reverse("shares", args=[public_artifact[1].token]),
+        ]:
+            response = client.get(url)
+            assert response.status_code == 200
+            assert b"".join(response.streaming_content) == b"0123456789abcdefghij"
+            assert response["Content-Length"] == "20"
+            assert response["Content-Type"] == "text/plain"
+            assert "X-Accel-Redirect" not in response
+            assert "X-Sendfile" not in response
+
+    def test_nginx(self, client, settings, public_artifact):
+        settings.ARTIFACTORIAL_DOWNLOAD_BACKEND = "nginx"
+        for url in [
+            reverse("artifacts", args=["pub/data.txt"]),
+            reverse("shares", args=[public_artifact[1].token]),
+        ]:
+            response = client.get(url)
+            assert response.status_code == 200
+            assert response.content == b""
+            assert response["X-Accel-Redirect"] == "/protected/pub/data.txt"
+            assert response["Content-Type"] == "text/plain"
+            assert "X-Sendfile" not in response
+
+        settings.ARTIFACTORIAL_DOWNLOAD_NGINX_LOCATION = "/internal/media"
+        response = client.get(reverse("artifacts", args=["pub/data.txt"]))
+        assert response["X-Accel-Redirect"] == "/internal/media/pub/data.txt"
+
+    def test_apache(self, client, settings, public_artifact):
+        settings.ARTIFACTORIAL_DOWNLOAD_BACKEND = "apache"
+        for url in [
+            reverse("artifacts", args=["pub/data.txt"]),
+            reverse("shares", args=[public_artifact[1].token]),
+        ]:
+            response = client.get(url)
+            assert response.status_code == 200
+            assert response.content == b""
+            assert response["X-Sendfile"] == public_artifact[0].path.path
+            assert response["Content-Type"] == "text/plain"
+            assert "X-Accel-Redirect" not in response
+
+    def test_permissions(self, client, settings, public_artifact):
+        settings.ARTIFACTORIAL_DOWNLOAD_BACKEND = "nginx"
+        public_artifact[0].directory.is_public = False
+        public_artifact[0].directory.user = User.objects.get(username="user1")
+        public_artifact[0].directory.save()
+        response = client.get(reverse("artifacts", args=["pub/data.txt"]))
+        assert response.status_code == 403
+        assert "X-Accel-Redirect" not in response
+
+    def test_invalid_backend(self, client, settings, public_artifact):
+        settings.ARTIFACTORIAL_DOWNLOAD_BACKEND = "lighttpd"
+        with pytest.raises(ImproperlyConfigured):
+            client.get(reverse("artifacts", args=["pub/data.txt"]))
+
+
+class TestRanges(object):
+    def urls(self, public_artifact):
+        return [
+            reverse("artifacts", args=["pub/data.txt"]),
+            reverse("shares", args=[public_artifact[1].token]),
+        ]
+
+    def test_single_range(self, client, public_artifact):
+        for url in self.urls(public_artifact):
+            response = client.get(url, HTTP_RANGE="bytes=2-5")
+            assert response.status_code == 206
+            assert response["Accept-Ranges"] == "bytes"
+            assert response["Content-Range"] == "bytes 2-5/20"
+            assert response["Content-Length"] == "4"
+            assert b"".join(response.streaming_content) == b"2345"
+
+            # Open ended range
+            response = client.get(url, HTTP_RANGE="bytes=15-")
+            assert response.status_code == 206
+            assert response["Content-Range"] == "bytes 15-19/20"
+            assert b"".join(response.streaming_content) == b"fghij"
+
+            # Suffix range
+            response = client.get(url, HTTP_RANGE="bytes=-3")
+            assert response.status_code == 206
+            assert response["Content-Range"] == "bytes 17-19/20"
+            assert b"".join(response.streaming_content) == b"hij"
+
+            # End after the end of file
+            response = client.get(url, HTTP_RANGE="bytes=18-100")
+            assert response.status_code == 206
+            assert response["Content-Range"] == "bytes 18-19/20"
+            assert b"".join(response.streaming_content) == b"ij"
+
+    def test_multiple_ranges(self, client, public_artifact):
+        for url in self.urls(public_artifact):
+            response = client.get(url, HTTP_RANGE="bytes=0-1, 10-12")
+            assert response.status_code == 206
+            content_type = response["Content-Type"]
+            assert content_type.startswith("multipart/byteranges; boundary=")
+            boundary = content_type.split("=")[1].encode("ascii")
+            content = b"".join(response.streaming_content)
+            assert int(response["Content-Length"]) == len(content)
+            assert content == (
+                b"--%s\r\nContent-Type: text/plain\r\n"
+                b"Content-Range: bytes 0-1/20\r\n\r\n01\r\n"
+                b"--%s\r\nContent-Type: text/plain\r\n"
+                b"Content-Range: bytes 10-12/20\r\n\r\nabc\r\n"
+                b"--%s--\r\n" % (boundary, boundary, boundary)
+            )
+
+            # Overlapping ranges are merged
+            response = client.get(url, HTTP_RANGE="bytes=0-4,3-7")
+            assert response.status_code == 206
+            assert response["Content-Range"] == "bytes 0-7/20"
+            assert b"".join(response.streaming_content) == b"01234567"
+
+    def test_unsatisfiable(self, client, public_artifact):
+        for url in self.urls(public_artifact):
+            response = client.get(url, HTTP_RANGE="bytes=20-30")
+            assert response.status_code == 416
+            assert response["Content-Range"] == "bytes */20"
+
+    def test_empty_file(self, client, settings, public_artifact):
+        open(os.path.join(settings.MEDIA_ROOT, "pub", "empty.txt"), "w").close()
+        Artifact.objects.create(
+            path="pub/empty.txt", directory=public_artifact[0].directory
+        )
+        url = reverse("artifacts", args=["pub/empty.txt"])
+        for header in ["bytes=-3", "bytes=0-", "bytes=0-0"]:
+            response = client.get(url, HTTP_RANGE=header)
+            assert response.status_code == 416
+            assert response["Content-Range"] == "bytes */0"
+
+    def test_ignored(self, client, public_artifact):
+        for url in self.urls(public_artifact):
+            for header in ["items=0-2", "bytes=5-2", "bytes=a-b", "bytes=-"]:
+                response = client.get(url, HTTP_RANGE=header)
+                assert response.status_code == 200
+                assert b"".join(response.streaming_content) == b"0123456789abcdefghij"
+
+    def test_if_range(self, client, public_artifact):
+        for url in self.urls(public_artifact):
+            response = client.get(url)
+            last_modified = response["Last-Modified"]
+
+            response = client.get(
+                url, HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE=last_modified
+            )
+            assert response.status_code == 206
+            assert b"".join(response.streaming_content) == b"01"
+
+            response = client.get(
+                url,
+                HTTP_RANGE="bytes=0-1",
+                HTTP_IF_RANGE="Mon, 01 Jan 2001 00:00:00 GMT",
+            )
+            assert response.status_code == 200
+            assert b"".join(response.streaming_content) == b"0123456789abcdefghij"
+
+    def test_offload(self, client, settings, public_artifact):
+        # The front-end web server is handling the ranges
+        settings.ARTIFACTORIAL_DOWNLOAD_BACKEND = "nginx"
+        for url in self.urls(public_artifact):
+            response = client.get(url, HTTP_RANGE="bytes=2-5")
+            assert response.status_code == 200
+            assert response["Accept-Ranges"] == "bytes"
+            assert response["X-Accel-Redirect"] == "/protected/pub/data.txt"
+            assert "Content-Range" not in response
+
+
+class TestConditional(object):
+    def test_artifacts(self, client, public_artifact):
+        for url in [
+            reverse("artifacts", args=["pub/data.txt"]),
+            reverse("shares", args=[public_artifact[1].token]),
+        ]:
+            response = client.get(url)
+            assert response.status_code == 200
+            etag = response["ETag"]
+            last_modified = response["Last-Modified"]
+            assert re.match('^"[0-9a-f]+-[0-9a-f]+"$', etag)
+
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+            assert response.status_code == 304
+            assert response["ETag"] == etag
+            assert response.content == b""
+            response = client.get(url, HTTP_IF_NONE_MATCH='"something-else"')
+            assert response.status_code == 200
+
+            response = client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            assert response.status_code == 304
+            response = client.get(
+                url, HTTP_IF_MODIFIED_SINCE="Mon, 01 Jan 2001 00:00:00 GMT"
+            )
+            assert response.status_code == 200
+
+            # If-Range with the ETag
+            response = client.get(url, HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE=etag)
+            assert response.status_code == 206
+            response = client.get(
+                url, HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE='"something-else"'
+            )
+            assert response.status_code == 200
+
+        # HEAD
+        url = reverse("artifacts", args=["pub/data.txt"])
+        response = client.head(url)
+        assert response.status_code == 200
+        # Now that the digest is known, the ETag is based on it
+        public_artifact[0].refresh_from_db()
+        assert response["ETag"] == '"%s"' % public_artifact[0].sha256
+        response = client.head(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        assert response.status_code == 304
+        response = client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        assert response.status_code == 304
+
+    def test_cache_control(self, client, settings, public_artifact):
+        url = reverse("artifacts", args=["pub/data.txt"])
+        response = client.get(url)
+        assert response["Cache-Control"] == "public, max-age=0"
+
+        public_artifact[0].is_permanent = True
+        public_artifact[0].save()
+        response = client.get(url)
+        assert response["Cache-Control"] == "public, max-age=2592000"
+        settings.ARTIFACTORIAL_PERMANENT_MAX_AGE = 3600
+        response = client.get(url)
+        assert response["Cache-Control"] == "public, max-age=3600"
+
+        directory = public_artifact[0].directory
+        directory.is_public = False
+        directory.save()
+        assert client.login(username="user1", password="123456")
+        response = client.get(url)
+        assert response["Cache-Control"] == "private, max-age=3600"
+
+    def test_listing(self, client, settings, tmpdir, public_artifact):
+        url = reverse("artifacts", args=["pub/"])
+        response = client.get(url)
+        assert response.status_code == 200
+        etag = response["ETag"]
+        assert etag.startswith('W/"')
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response["ETag"] == etag
+
+        # Other formats and users have different ETags
+        response = client.get(url + "?format=json", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert client.login(username="user1", password="123456")
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        client.logout()
+
+        # Adding an artifact invalidates the ETag
+        filename = str(tmpdir.join("new.txt"))
+        with open(filename, "w") as f_out:
+            f_out.write("new")
+        with open(filename, "r") as f_in:
+            response = client.post(url, data={"path": f_in})
+        assert response.status_code == 200
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        etag = response["ETag"]
+
+        # Removing an artifact too
+        public_artifact[0].delete()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
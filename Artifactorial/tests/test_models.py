@@ -9,14 +9,26 @@
 
 from django.contrib.auth.models import AnonymousUser, Group, User
 from django.core.exceptions import ValidationError
+from django.db import connection, transaction
 from django.db.utils import IntegrityError
-
-from Artifactorial.models import Artifact, Directory, AuthToken, Share
+from django.utils import timezone
+
+from Artifactorial.models import (
+    Artifact,
+    Directory,
+    AuthToken,
+    PathNode,
+    PendingDeletion,
+    Share,
+    drain_deletions,
+)
+from Artifactorial.permissions import PermissionResolver
 
 from datetime import timedelta
 import os
 import pytest
 import sys
+import threading
 
 
 @pytest.fixture
@@ -211,6 +223,34 @@ class TestDirectory(object):
         assert directory.is_writable_to(users["u"][1]) == False
         assert directory.is_writable_to(users["u"][2]) == False
 
+    def test_permission_resolver(self, users, django_assert_num_queries):
+        Directory.objects.create(path="/anonymous", is_public=False)
+        Directory.objects.create(path="/pub", is_public=True)
+        Directory.objects.create(path="/home/user1", user=users["u"][0])
+        Directory.objects.create(path="/home/user2", user=users["u"][1], is_public=True)
+        Directory.objects.create(path="/home/grp1", group=users["g"][0])
+        Directory.objects.create(path="/home/grp2", group=users["g"][1])
+        inactive = User.objects.create_user("user4", is_active=False)
+        directories = list(Directory.objects.order_by("path"))
+
+        for user in users["u"] + [AnonymousUser(), inactive]:
+            resolver = PermissionResolver(user)
+            # The groups are loaded only once
+            with django_assert_num_queries(1 if user.is_authenticated else 0):
+                visible = [d.path for d in directories if resolver.is_visible(d)]
+                writable = [d.path for d in directories if resolver.is_writable(d)]
+            assert visible == [d.path for d in directories if d.is_visible_to(user)]
+            assert writable == [d.path for d in directories if d.is_writable_to(user)]
+            # The filter selects the same directories
+            assert visible == list(
+                Directory.objects.filter(resolver.visible_q())
+                .order_by("path")
+                .values_list("path", flat=True)
+            )
+            assert (
+                Artifact.objects.filter(resolver.visible_q("directory__")).count() == 0
+            )
+
     def test_quota_progress(self, users):
         directory = Directory.objects.create(
             path="/home/grp2", group=users["g"][1], quota=500
@@ -218,12 +258,10 @@ class TestDirectory(object):
         assert directory.size() == 0
         assert directory.quota_progress() == 0
 
-        directory.size = lambda: 50
-        assert directory.size() == 50
+        directory.used_bytes = 50
         assert directory.quota_progress() == 10
 
-        directory.size = lambda: 500
-        assert directory.size() == 500
+        directory.used_bytes = 500
         assert directory.quota_progress() == 100
 
     def test_clean_old_files(self, users, settings, tmpdir):
@@ -266,9 +304,14 @@ class TestDirectory(object):
         assert dir1.artifact_set.count() == 3
         assert dir2.artifact_set.count() == 3
 
+        # Changing the TTL does not change the expiration of the artifacts
         dir1.ttl = 2
         dir1.save()
         dir1.clean_old_files(purge=False)
+        assert dir1.artifact_set.count() == 3
+
+        Artifact.objects.filter(pk=user1_arts[2].pk).update(expires_at=timezone.now())
+        dir1.clean_old_files(purge=False)
         assert dir1.artifact_set.count() == 2
         assert os.path.exists(user1_arts[0].path.path) == True
         assert os.path.exists(user1_arts[1].path.path) == True
@@ -308,6 +351,224 @@ class TestDirectory(object):
         assert os.path.exists(user1_arts[1].path.path) == False
         assert os.path.exists(user1_arts[2].path.path) == False
 
+    def test_expires_at(self, users, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        dir1 = Directory.objects.create(path="/pub", ttl=3)
+        dir2 = Directory.objects.create(path="/keep", ttl=0)
+        media.join("pub", "a.txt").write("data", ensure=True)
+
+        art = Artifact.objects.create(directory=dir1, path="pub/a.txt")
+        expires_at = art.expires_at
+        assert abs(expires_at - art.created_at - timedelta(days=3)).seconds < 1
+        # Changing the TTL does not change the expiration
+        dir1.ttl = 1
+        dir1.save()
+        art.refresh_from_db()
+        assert art.expires_at == expires_at
+
+        art.is_permanent = True
+        art.save()
+        assert Artifact.objects.get(pk=art.pk).expires_at is None
+        art.is_permanent = False
+        art.save()
+        assert Artifact.objects.get(pk=art.pk).expires_at == (
+            art.created_at + timedelta(days=1)
+        )
+
+        art = Artifact.objects.create(directory=dir2, path="pub/a.txt")
+        assert art.expires_at is None
+        art = Artifact.objects.create(
+            directory=dir1, path="pub/a.txt", is_permanent=True
+        )
+        assert art.expires_at is None
+
+    def test_usage_counters(self, users, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        dir1 = Directory.objects.create(path="/home/user1", user=users["u"][0])
+        dir2 = Directory.objects.create(path="/home/user2", user=users["u"][1])
+        root = media.mkdir("home").mkdir("user1")
+
+        arts = []
+        for (index, f_name) in enumerate(["file1.txt", "testing.py", "hello.jpg"]):
+            filename = str(root.join(f_name))
+            with open(filename, "wb") as f_out:
+                f_out.write(os.urandom(10 * (index + 1)))
+            art = Artifact.objects.create(directory=dir1, path=filename)
+            art.created_at -= timedelta(days=index)
+            art.save()
+            arts.append(art)
+
+        dir1.refresh_from_db()
+        assert dir1.used_bytes == 60
+        assert dir1.artifact_count == 3
+        assert dir1.size() == 60
+
+        # Saving an outdated instance does not reset the counters
+        dir2.quota = 1234
+        dir2.save()
+        stale = Directory.objects.get(pk=dir1.pk)
+        arts[0].delete()
+        stale.ttl = 2
+        stale.save()
+        dir1.refresh_from_db()
+        assert dir1.ttl == 2
+        assert dir1.used_bytes == 50
+        assert dir1.artifact_count == 2
+
+        # Removing old files
+        Artifact.objects.filter(pk=arts[2].pk).update(expires_at=timezone.now())
+        dir1.clean_old_files(purge=False)
+        dir1.refresh_from_db()
+        assert dir1.used_bytes == 20
+        assert dir1.artifact_count == 1
+
+        # Drift
+        Directory.objects.filter(pk=dir1.pk).update(used_bytes=3, artifact_count=4)
+        dir1.refresh_from_db()
+        assert dir1.recompute_usage() == True
+        assert dir1.used_bytes == 20
+        assert dir1.artifact_count == 1
+        assert dir1.recompute_usage() == False
+        assert dir2.recompute_usage() == False
+        assert dir2.used_bytes == 0
+        assert dir2.artifact_count == 0
+
+    def test_path_tree(self, users, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        dir1 = Directory.objects.create(path="/pub", is_public=True)
+        root = media.mkdir("pub").mkdir("2018")
+        arts = []
+        for index, f_name in enumerate(["01/file1.txt", "01/file2.txt", "02/a.py"]):
+            root.ensure(f_name)
+            with open(str(root.join(f_name)), "wb") as f_out:
+                f_out.write(os.urandom(10 * (index + 1)))
+            arts.append(
+                Artifact.objects.create(directory=dir1, path="pub/2018/" + f_name)
+            )
+
+        node = PathNode.objects.get(path="pub/2018")
+        assert node.name == "2018"
+        assert node.parent.path == "pub"
+        assert node.parent.parent is None
+        assert node.size == 60
+        assert node.file_count == 3
+        assert node.latest_mtime is not None
+        assert [(n.name, n.size, n.file_count) for n in node.children.all()] == [
+            ("01", 30, 2),
+            ("02", 30, 1),
+        ]
+        assert arts[0].node.path == "pub/2018/01"
+        assert list(PathNode.objects.get(path="pub/2018/02").artifacts.all()) == [
+            arts[2]
+        ]
+
+        arts[2].delete()
+        node.refresh_from_db()
+        assert node.size == 30
+        assert node.file_count == 2
+        assert PathNode.objects.get(path="pub").size == 30
+        assert not PathNode.objects.filter(path="").exists()
+        # Empty folders are kept until the next clean
+        empty = PathNode.objects.get(path="pub/2018/02")
+        assert empty.size == 0
+        assert empty.file_count == 0
+
+        # A new file reuses the empty folder
+        root.ensure("02/b.py")
+        art = Artifact.objects.create(directory=dir1, path="pub/2018/02/b.py")
+        assert art.node.pk == empty.pk
+        empty.refresh_from_db()
+        assert empty.file_count == 1
+        assert PathNode.objects.filter(path="pub/2018/02").count() == 1
+
+
+def run_concurrently(func, count):
+    """
+    Call func in count threads, started at the same time, and return the
+    results.
+    """
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(index):
+        try:
+            barrier.wait()
+            results[index] = func(index)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=[i]) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+@pytest.mark.django_db(transaction=True)
+class TestQuotaReservation(object):
+    def test_reserve_release(self):
+        directory = Directory.objects.create(path="/pub", quota=100)
+        assert directory.reserve(60) == True
+        assert directory.reserve(50) == False
+        assert directory.reserve(40) == True
+        assert directory.reserve(1) == False
+        directory.release(40)
+        directory.refresh_from_db()
+        assert directory.reserved_bytes == 60
+        assert directory.used_bytes == 0
+
+        # Saving the directory does not drop the reservations
+        directory.quota = 200
+        directory.save()
+        directory.refresh_from_db()
+        assert directory.reserved_bytes == 60
+
+        assert directory.recompute_usage() == False
+        assert directory.reserved_bytes == 60
+        assert directory.recompute_usage(reset_reservations=True) == True
+        assert directory.reserved_bytes == 0
+
+    def test_concurrent_reservations(self):
+        directory = Directory.objects.create(path="/pub", quota=100)
+        results = run_concurrently(lambda index: directory.reserve(10), 20)
+        assert results.count(True) == 10
+        assert results.count(False) == 10
+        directory.refresh_from_db()
+        assert directory.reserved_bytes == 100
+
+    def test_concurrent_artifacts(self, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        root = media.mkdir("pub")
+        directory = Directory.objects.create(path="/pub", quota=100)
+
+        def upload(index):
+            if not directory.reserve(10):
+                return False
+            filename = str(root.join("file%d.txt" % index))
+            with open(filename, "w") as f_out:
+                f_out.write("0123456789")
+            try:
+                with transaction.atomic():
+                    Artifact.objects.create(directory=directory, path=filename)
+                    directory.release(10)
+            except Exception:
+                directory.release(10)
+                raise
+            return True
+
+        results = run_concurrently(upload, 16)
+        assert results.count(True) == 10
+        directory.refresh_from_db()
+        assert directory.used_bytes == 100
+        assert directory.artifact_count == 10
+        assert directory.reserved_bytes == 0
+        assert directory.recompute_usage() == False
+
 
 class TestArtifact(object):
     def test_methods(self, users, settings, tmpdir):
@@ -324,6 +585,14 @@ class TestArtifact(object):
 
         assert artifact.path.size == 12
         assert str(artifact) == filename
+        # Metadata are stored in the database
+        artifact = Artifact.objects.get(pk=artifact.pk)
+        assert artifact.size == 12
+        assert artifact.content_type == "text/plain"
+        assert artifact.stored_at.timestamp() == pytest.approx(
+            os.stat(filename).st_mtime
+        )
+        assert directory.size() == 12
 
         assert artifact.is_visible_to(users["u"][0]) == True
         assert artifact.is_visible_to(users["u"][1]) == False
@@ -331,6 +600,42 @@ class TestArtifact(object):
 
         assert artifact.get_absolute_url() == "/artifacts/%s" % filename
 
+    def test_deletion(self, transactional_db, settings, tmpdir):
+        media = tmpdir.mkdir("media")
+        settings.MEDIA_ROOT = str(media)
+        directory = Directory.objects.create(path="/pub")
+        for name in ["a.txt", "b.txt", "c.txt"]:
+            media.join("pub", name).write("data", ensure=True)
+            Artifact.objects.create(directory=directory, path="pub/" + name)
+
+        # Rolled back: the file is kept
+        with pytest.raises(IntegrityError):
+            with transaction.atomic():
+                Artifact.objects.get(path="pub/a.txt").delete()
+                assert media.join("pub", "a.txt").check()
+                raise IntegrityError()
+        assert media.join("pub", "a.txt").check()
+        assert Artifact.objects.count() == 3
+        assert PendingDeletion.objects.count() == 0
+
+        # Removed once committed
+        Artifact.objects.get(path="pub/a.txt").delete()
+        assert not media.join("pub", "a.txt").check()
+        assert PendingDeletion.objects.count() == 0
+
+        # Left to the drainer
+        settings.ARTIFACTORIAL_INLINE_DELETION = False
+        Artifact.objects.get(path="pub/b.txt").delete()
+        assert media.join("pub", "b.txt").check()
+        assert [str(p) for p in PendingDeletion.objects.all()] == ["pub/b.txt"]
+        # A new artifact with the same name is kept
+        PendingDeletion.objects.create(path="pub/c.txt")
+        folders = set()
+        assert drain_deletions(folders=folders) == 2
+        assert folders == set(["pub"])
+        assert os.listdir(str(media.join("pub"))) == ["c.txt"]
+        assert PendingDeletion.objects.count() == 0
+
 
 class TestShare(object):
     def test_str_and_url(self, users, settings, tmpdir):
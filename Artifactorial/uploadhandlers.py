@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# vim: set ts=4
+#
+# Copyright 2017-present Linaro Limited
+#
+# Author: Rémi Duraffort <remi.duraffort@linaro.org>
+#
+# SPDX-License-Identifier: MIT
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+
+import hashlib
+
+
+class DigestUploadHandler(FileUploadHandler):
+    """
+    Compute the digests of the uploaded files while the data is received.
+    The chunks are passed untouched to the next handlers.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests = {}
+        self.md5 = None
+        self.sha256 = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.md5.update(raw_data)
+        self.sha256.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = (self.md5.hexdigest(), self.sha256.hexdigest())
+        return None
+
+
+class QuotaUploadHandler(FileUploadHandler):
+    """
+    Reject the upload as soon as the files do not fit in the available space.
+
+    The Content-Length is checked before reading the body (so a client
+    sending "Expect: 100-continue" will not send it at all), then the bytes
+    are counted while they are received.
+    As the Content-Length includes the multipart framing and the other
+    fields, ARTIFACTORIAL_UPLOAD_OVERHEAD bytes are tolerated above the
+    available space.
+    """
+
+    def __init__(self, request, available):
+        super().__init__(request)
+        self.available = available
+        self.received = 0
+        self.exceeded = False
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None
+    ):
+        overhead = getattr(settings, "ARTIFACTORIAL_UPLOAD_OVERHEAD", 64 * 1024)
+        if content_length - overhead > self.available:
+            self.exceeded = True
+            # Skip the parsing: the body is never read
+            return (QueryDict(encoding=encoding), MultiValueDict())
+        return None
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.available:
+            self.exceeded = True
+            raise StopUpload(connection_reset=True)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
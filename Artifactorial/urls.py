@@ -14,7 +14,6 @@ from django.urls import reverse_lazy
 
 import Artifactorial.views as a_views
 
-
 urlpatterns = [
     url(r"^$", a_views.home, name="home"),
     # Authentication
@@ -44,6 +43,9 @@ urlpatterns = [
     # Shares
     url(r"^shares/$", a_views.shares_root, name="shares.root"),
     url(r"^shares/(?P<token>.*)$", a_views.shares, name="shares"),
+    # Signed URLs
+    url(r"^signed/$", a_views.signed_root, name="signed.root"),
+    url(r"^signed/(?P<filename>.+)$", a_views.signed, name="signed"),
     # Tokens
     url(r"^tokens/$", a_views.tokens, name="tokens.index"),
     url(r"^tokens/(?P<id>\d+)/delete/$", a_views.tokens_delete, name="tokens.delete"),
@@ -8,12 +8,14 @@
 #
 # SPDX-License-Identifier: MIT
 
+from django.conf import settings
 from django.urls import reverse
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
-from django.forms import ModelForm
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.forms import BooleanField, ModelForm
 from django.http import (
-    FileResponse,
     Http404,
     HttpResponse,
     HttpResponseBadRequest,
@@ -21,16 +23,27 @@ from django.http import (
     HttpResponseNotAllowed,
     HttpResponseRedirect,
     QueryDict,
+    StreamingHttpResponse,
 )
 from django.shortcuts import get_object_or_404, render
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from django.views.decorators.csrf import csrf_exempt
 
-from Artifactorial.models import AuthToken, Artifact, Directory, Share
+from Artifactorial import authentication, downloads, listings, signing
+from Artifactorial.models import AuthToken, Artifact, Directory, PathNode, Share
+from Artifactorial.permissions import get_resolver
+from Artifactorial.uploadhandlers import DigestUploadHandler, QuotaUploadHandler
 
 import base64
+import binascii
 import hashlib
-import mimetypes
 import os
+import tempfile
+import time
+
+# Size of the chunks read from the request body on PUT
+PUT_CHUNK_SIZE = 1024 * 1024
 
 
 class ArtifactForm(ModelForm):
@@ -45,15 +58,13 @@ def home(request):
 
 
 def get_current_user(request, token):
-    # If the token is None, save one dummy sql request
-    if token is None:
+    # If the token is empty, save one dummy sql request
+    if not token:
         return request.user
 
     # Try to match find the token
-    try:
-        return AuthToken.objects.get(secret=token).user
-    except AuthToken.DoesNotExist:
-        return request.user
+    user = authentication.get_user(token)
+    return request.user if user is None else user
 
 
 def _delete(request, filename):
@@ -63,11 +74,22 @@ def _delete(request, filename):
     # The URL regexp removes the leading slash, so add it back
     filename = "/" + filename
 
-    # Only valid for artifacts
+    # Directories are purged in the background by the purge command
     if filename[-1] == "/":
-        return HttpResponseBadRequest()
+        directory = get_object_or_404(
+            Directory, path=filename.rstrip("/"), is_deleting=False
+        )
+        # Only the owners and the staff, anonymous directories being writable
+        # to all
+        owned = directory.user_id is not None or directory.group_id is not None
+        if not (user.is_staff or (owned and directory.is_writable_to(user))):
+            return HttpResponseForbidden()
+        directory.schedule_purge()
+        return HttpResponse("", status=202)
 
-    artifact = get_object_or_404(Artifact, path=filename.lstrip("/"))
+    artifact = get_object_or_404(
+        Artifact, path=filename.lstrip("/"), directory__is_deleting=False
+    )
 
     if not artifact.is_writable_to(user):
         return HttpResponseForbidden()
@@ -76,6 +98,54 @@ def _delete(request, filename):
     return HttpResponse("")
 
 
+def _encode_marker(kind, name):
+    # Opaque marker to the last entry of a listing page
+    return base64.urlsafe_b64encode(("%s:%s" % (kind, name)).encode("utf-8")).decode(
+        "ascii"
+    )
+
+
+def _decode_marker(marker):
+    if marker is None:
+        return None
+    kind, name = (
+        base64.urlsafe_b64decode(marker.encode("ascii")).decode("utf-8").split(":", 1)
+    )
+    if kind not in ["d", "f"]:
+        raise ValueError("Invalid marker")
+    return (kind, name)
+
+
+def _listing_etag(request, user, dirname):
+    """
+    Build the weak ETag of a directory listing.
+
+    The listing only depends on the directories above and under this prefix
+    (see Directory.updated_at), on the permissions of the user and on the
+    query string.
+    """
+    ancestors = []
+    path = dirname
+    while path != "/":
+        ancestors.append(path)
+        path = os.path.dirname(path)
+
+    marker = Directory.objects.filter(
+        Q(path__startswith=dirname) | Q(path__in=ancestors)
+    ).aggregate(count=Count("id"), updated_at=Max("updated_at"))
+    groups = sorted(get_resolver(request, user).group_ids)
+
+    key = "%s|%s|%s|%s|%s|%s" % (
+        marker["count"],
+        marker["updated_at"],
+        user.pk,
+        user.is_active,
+        groups,
+        request.GET.urlencode(),
+    )
+    return 'W/"%s"' % hashlib.md5(key.encode("utf-8")).hexdigest()
+
+
 def _get(request, filename):
     # Get the current user
     user = get_current_user(request, request.GET.get("token", None))
@@ -91,63 +161,173 @@ def _get(request, filename):
         if dirname == "/":
             dirname_length = 0
 
+        # Return the right formating (html, json, yaml or ndjson)
+        formating = request.GET.get("format", "html")
+        if formating != "html" and formating not in listings.SERIALIZERS:
+            return HttpResponseBadRequest()
+
+        # Pagination: the HTML pages are always paginated
+        limit = request.GET.get("limit", None)
+        if limit is None and formating == "html":
+            limit = getattr(settings, "ARTIFACTORIAL_LISTING_PAGE_SIZE", 1000)
+        try:
+            limit = None if limit is None else int(limit)
+            marker = _decode_marker(request.GET.get("marker", None))
+        except ValueError:
+            return HttpResponseBadRequest()
+        if limit is not None and limit <= 0:
+            return HttpResponseBadRequest()
+        # Recursive listings are only available to programs
+        recursive = BooleanField().to_python(request.GET.get("recursive", None))
+        if recursive and formating == "html":
+            return HttpResponseBadRequest()
+
+        # Conditional requests
+        etag = _listing_etag(request, user, dirname)
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            response["ETag"] = etag
+            return response
+
         dir_set = set()
-        art_list = list()
         in_real_directory = False
+        prefix = dirname.rstrip("/")
 
-        # List real directories
-        directories = Directory.objects.filter(
-            Q(path__startswith="%s" % (dirname)) | Q(path=dirname)
-        )
-        directories = directories.select_related("user", "group")
+        # List real directories, the current one, its parents and children
+        if dirname_length:
+            parts = dirname[1:].split("/")
+            parents = ["/" + "/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+            directories = Directory.objects.filter(
+                Q(path__startswith=prefix + "/") | Q(path__in=parents)
+            )
+        else:
+            directories = Directory.objects.all()
+        resolver = get_resolver(request, user)
+        visible = []
+        sub_dirs = []
+        owner = None
         for directory in directories:
-            if not directory.is_visible_to(user):
+            if directory.path.startswith(prefix + "/"):
+                sub_dirs.append(directory.path)
+            elif owner is None or len(directory.path) > len(owner.path):
+                # Deepest directory containing the current one
+                owner = directory
+            # Directories being purged are hidden
+            if directory.is_deleting or not resolver.is_visible(directory):
                 continue
-            if directory.path != dirname:
+            visible.append(directory.id)
+            if directory.path == dirname:
+                in_real_directory = True
+            elif directory.path.startswith(prefix + "/"):
                 # Sub directory => print the next elements in the path
                 full_dir_name = directory.path[dirname_length + 1 :]
-                if "/" in full_dir_name:
-                    dir_set.add(full_dir_name[: full_dir_name.index("/")])
-                else:
-                    dir_set.add(full_dir_name)
-            else:
-                in_real_directory = True
-
-        # List artifacts and pseudo directories
-        artifacts = Artifact.objects.filter(path__startswith=filename.lstrip("/"))
-        artifacts = artifacts.select_related(
-            "directory", "directory__user", "directory__group"
-        )
-        for artifact in artifacts:
-            if not artifact.is_visible_to(user):
-                continue
-            relative_name = artifact.path.name[dirname_length:]
-            # Add pseudo directory (if the name contains a '/')
-            if "/" in relative_name:
-                dir_set.add(relative_name[: relative_name.index("/")])
-            else:
-                art_list.append(
-                    (artifact.path.name[dirname_length:], artifact.path.size)
+                dir_set.add(full_dir_name.split("/")[0])
+
+        if recursive:
+            artifacts = Artifact.objects.filter(
+                path__startswith=filename.lstrip("/"), directory__in=visible
+            )
+            if (
+                marker is None
+                and not dir_set
+                and not in_real_directory
+                and not dirname_length == 0
+                and not artifacts.exists()
+            ):
+                raise Http404
+            return _manifest(
+                request, dirname, artifacts, limit, marker, formating, etag
+            )
+
+        # List pseudo directories and artifacts from the tree of folders.
+        # Directories come first, then files, both sorted by name. One more
+        # entry is fetched to know if a next page exists.
+        want = None if limit is None else limit + 1
+        kind, after = marker or ("d", None)
+        folders = []
+        files = Artifact.objects.none().values_list("path", "size")
+        node = PathNode.objects.filter(path=prefix.lstrip("/")).first()
+        if kind == "d":
+            folders = [(d, None) for d in dir_set if after is None or d > after]
+            if node is not None and visible:
+                # The counters of the folders include the artifacts of every
+                # directory: the folders of the hidden sub-directories, or all
+                # the folders if the current directory is hidden, are only
+                # listed when visible artifacts are below them
+                containers = set(
+                    path[len(prefix) + 1 :].split("/")[0] for path in sub_dirs
                 )
+                checked = owner is None or owner.id not in visible
+                children = node.children.filter(file_count__gt=0).order_by("name")
+                if after is not None:
+                    children = children.filter(name__gt=after)
+                count = 0
+                for name, size in children.values_list("name", "size").iterator():
+                    if name in dir_set:
+                        # Listed above
+                        continue
+                    if checked or name in containers:
+                        below = Artifact.objects.filter(
+                            path__startswith=os.path.join(node.path, name, ""),
+                            directory__in=visible,
+                        )
+                        if not below.exists():
+                            continue
+                        size = None
+                    folders.append((name, size))
+                    count += 1
+                    if want is not None and count >= want:
+                        break
+            folders = sorted(folders)[:want]
+        if node is not None and (want is None or len(folders) < want):
+            artifacts = node.artifacts.filter(directory__in=visible).order_by("path")
+            if kind == "f":
+                artifacts = artifacts.filter(path__gt=after)
+            files = artifacts.values_list("path", "size")
+        # Without limit, the artifacts are streamed from the database cursor
+        if want is not None:
+            files = list(files[: max(want - len(folders), 0)])
 
         # Raise an error if the directory does not exist
         if (
-            not dir_set
-            and not art_list
+            marker is None
+            and not folders
+            and not (files if want is not None else files.exists())
             and not in_real_directory
             and not dirname_length == 0
         ):
             raise Http404
 
-        # Return the right formating (only html, json or yaml)
-        formating = request.GET.get("format", "html")
-        content_types = {
-            "html": "text/html",
-            "json": "application/json",
-            "yaml": "application/yaml",
-        }
-        if formating not in content_types:
-            return HttpResponseBadRequest()
+        next_url = None
+        if want is not None and len(folders) + len(files) == want:
+            # The marker is the last entry actually returned
+            if len(folders) >= limit:
+                folders, files = (folders[:limit], [])
+                next_marker = ("d", folders[-1][0])
+            else:
+                files = files[: limit - len(folders)]
+                next_marker = ("f", files[-1][0])
+            query = request.GET.copy()
+            query["marker"] = _encode_marker(*next_marker)
+            next_url = request.build_absolute_uri("?" + query.urlencode())
+
+        if formating != "html":
+            serializer, content_type = listings.SERIALIZERS[formating]
+            if want is None:
+                files = files.iterator()
+            response = StreamingHttpResponse(
+                serializer(
+                    dirname,
+                    folders,
+                    ((os.path.basename(path), size) for (path, size) in files),
+                    next_url,
+                ),
+                content_type=content_type,
+            )
+            response["ETag"] = etag
+            if next_url is not None:
+                response["Link"] = '<%s>; rel="next"' % next_url
+            return response
 
         # Build the breadcrumb
         breadcrumb = []
@@ -159,53 +339,116 @@ def _get(request, filename):
         else:
             breadcrumb = []
 
-        return render(
+        response = render(
             request,
-            "Artifactorial/list.%s" % formating,
+            "Artifactorial/list.html",
             {
                 "directory": dirname,
                 "breadcrumb": breadcrumb,
-                "directories": sorted(dir_set),
-                "files": sorted(art_list),
+                "directories": [name for (name, _) in folders],
+                "folders": folders,
+                "files": [(os.path.basename(path), size) for (path, size) in files],
+                "next": next_url,
                 "token": request.GET.get("token", None),
             },
-            content_type=content_types[formating],
         )
+        response["ETag"] = etag
+        return response
 
     else:
         # Serving the file
-        # TODO: use django-sendfile for better performances
-        artifact = get_object_or_404(Artifact, path=filename.lstrip("/"))
+        artifact = get_object_or_404(
+            Artifact, path=filename.lstrip("/"), directory__is_deleting=False
+        )
         if not artifact.is_visible_to(user):
             return HttpResponseForbidden()
 
-        # Guess the mimetype
-        mime = mimetypes.guess_type(artifact.path.name)
-        response = FileResponse(
-            open(artifact.path.path, "rb"),
-            content_type=mime[0] if mime[0] else "text/plain",
-        )
+        return downloads.serve(request, artifact)
 
-        response["Content-Length"] = artifact.path.size
-        return response
+
+def _manifest(request, dirname, artifacts, limit, marker, formating, etag):
+    """
+    Stream every artifact below the directory. Without limit, the rows are
+    read from a server-side cursor when the database supports it.
+    """
+    prefix_length = len(dirname.lstrip("/")) + 1 if dirname != "/" else 0
+    artifacts = artifacts.order_by("path").values_list(
+        "path", "size", "created_at", "is_permanent", "md5", "sha256"
+    )
+    if marker is not None and marker[0] == "f":
+        artifacts = artifacts.filter(path__gt=marker[1])
+
+    next_url = None
+    if limit is None:
+        artifacts = artifacts.iterator()
+    else:
+        artifacts = list(artifacts[: limit + 1])
+        if len(artifacts) > limit:
+            artifacts = artifacts[:limit]
+            query = request.GET.copy()
+            query["marker"] = _encode_marker("f", artifacts[-1][0])
+            next_url = request.build_absolute_uri("?" + query.urlencode())
+
+    entries = (
+        {
+            "path": path[prefix_length:],
+            "size": size,
+            "created_at": created_at.isoformat(),
+            "is_permanent": is_permanent,
+            "md5": md5 or None,
+            "sha256": sha256 or None,
+        }
+        for (path, size, created_at, is_permanent, md5, sha256) in artifacts
+    )
+    serializer, content_type = listings.MANIFEST_SERIALIZERS[formating]
+    response = StreamingHttpResponse(
+        serializer(dirname, entries, next_url), content_type=content_type
+    )
+    response["ETag"] = etag
+    if next_url is not None:
+        response["Link"] = '<%s>; rel="next"' % next_url
+    return response
 
 
 def _head(request, filename):
     user = get_current_user(request, request.GET.get("token", ""))
-    artifact = get_object_or_404(Artifact, path=filename.lstrip("/"))
+    artifact = get_object_or_404(
+        Artifact, path=filename.lstrip("/"), directory__is_deleting=False
+    )
     if not artifact.is_visible_to(user):
         return HttpResponseForbidden()
 
+    # Digests are computed at upload time. Compute and save them for older
+    # artifacts.
+    if not artifact.md5 or not artifact.sha256:
+        artifact.md5, artifact.sha256 = artifact.compute_digests()
+        Artifact.objects.filter(pk=artifact.pk).update(
+            md5=artifact.md5, sha256=artifact.sha256
+        )
+
+    # Conditional requests
+    etag, last_modified, size = downloads.get_validators(artifact)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        downloads.set_validators(response, artifact, etag, last_modified)
+        return response
+
     # Build the response
     response = HttpResponse("")
-    mime = mimetypes.guess_type(artifact.path.name)
-    response["Content-Type"] = mime[0] if mime[0] else "text/plain"
-    response["Content-Length"] = artifact.path.size
-    # Compute the MD5
-    md5 = hashlib.md5()
-    for chunk in artifact.path.chunks():
-        md5.update(chunk)
-    response["Content-MD5"] = base64.b64encode(md5.hexdigest().encode("utf-8"))
+    response["Content-Type"] = downloads.get_content_type(artifact)
+    response["Content-Length"] = size
+    response["Accept-Ranges"] = "bytes"
+    downloads.set_validators(response, artifact, etag, last_modified)
+
+    md5 = binascii.a2b_hex(artifact.md5)
+    sha256 = binascii.a2b_hex(artifact.sha256)
+    # Keep the historical format: base64 of the hexadecimal digest
+    response["Content-MD5"] = base64.b64encode(artifact.md5.encode("utf-8"))
+    response["Digest"] = "md5=%s,sha-256=%s" % (
+        base64.b64encode(md5).decode("ascii"),
+        base64.b64encode(sha256).decode("ascii"),
+    )
+    response["Repr-Digest"] = "sha-256=:%s:" % base64.b64encode(sha256).decode("ascii")
 
     return response
 
@@ -215,37 +458,223 @@ def _post(request, filename):
     filename = filename.rstrip("/")
     # Find the directory by name
     directory_path = "/" + filename
-    directory = get_object_or_404(Directory, path=directory_path)
-
-    user = get_current_user(request, request.POST.get("token", ""))
+    directory = get_object_or_404(Directory, path=directory_path, is_deleting=False)
+
+    # Presigned URLs grant the access without any token
+    presigned = "sig" in request.GET
+    available = directory.quota - directory.used_bytes - directory.reserved_bytes
+    if presigned:
+        grant = signing.verify_upload(directory.path, request.GET)
+        if grant is None:
+            return HttpResponseForbidden()
+        if grant[1] is not None:
+            available = min(available, grant[1])
+
+    # Compute the digests while receiving the file and stop the upload as soon
+    # as it does not fit in the quota. This should be done before accessing
+    # request.POST or request.FILES.
+    digests = DigestUploadHandler(request)
+    quota = QuotaUploadHandler(request, available)
+    request.upload_handlers.insert(0, digests)
+    request.upload_handlers.insert(0, quota)
+
+    token = request.POST.get("token", "")
+    if quota.exceeded:
+        return HttpResponseForbidden()
 
     # Is the directory writable to this user?
-    if not directory.is_writable_to(user):
-        return HttpResponseForbidden()
+    if not presigned:
+        user = get_current_user(request, token)
+        if not directory.is_writable_to(user):
+            return HttpResponseForbidden()
 
-    # Check the quota
+    try:
+        ttl = _get_ttl(directory, request.POST.get("ttl"))
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    # Reserve the space in the quota. Concurrent uploads cannot exceed it.
+    reserved = 0
     if "path" in request.FILES:
-        if request.FILES["path"].size + directory.size() > directory.quota:
+        reserved = request.FILES["path"].size
+        if not directory.reserve(reserved):
             return HttpResponseForbidden()
 
-    # Validate the updated form
-    form = ArtifactForm(
-        {
-            "directory": directory.id,
-            "is_permanent": request.POST.get("is_permanent", False),
-        },
-        request.FILES,
-    )
-    if form.is_valid():
-        artifact = form.save()
-        # TODO: does not work with alternate storage
-        return HttpResponse(
-            request.build_absolute_uri(reverse("artifacts", args=[artifact.path.url])),
-            content_type="text/plain",
+    try:
+        # Validate the updated form
+        form = ArtifactForm(
+            {
+                "directory": directory.id,
+                "is_permanent": request.POST.get("is_permanent", False),
+            },
+            request.FILES,
         )
+        if not form.is_valid():
+            return HttpResponseBadRequest()
+
+        artifact = form.save(commit=False)
+        artifact.md5, artifact.sha256 = digests.digests["path"]
+        artifact.size = request.FILES["path"].size
+        artifact.stored_at = timezone.now()
+        if ttl is not None:
+            artifact.expires_at = directory.get_expiration(ttl)
+        _save_artifact(artifact, reserved)
+        reserved = 0
+    finally:
+        if reserved:
+            directory.release(reserved)
+
+    return _artifact_url(request, artifact)
+
+
+def _put(request, filename):
+    # PUT is only allowed on artifacts, not on directories
+    if not filename or filename.endswith("/"):
+        return HttpResponseNotAllowed(["DELETE", "GET", "HEAD", "POST"])
+    # Find the directory by name
+    dirname, name = os.path.split(filename)
+    if name in ("", ".", ".."):
+        return HttpResponseBadRequest()
+    directory = get_object_or_404(Directory, path="/" + dirname, is_deleting=False)
+
+    # The body is the file: the token or the signature of a presigned URL are
+    # given in the query string
+    max_size = None
+    if "sig" in request.GET:
+        grant = signing.verify_upload(directory.path, request.GET)
+        if grant is None:
+            return HttpResponseForbidden()
+        max_size = grant[1]
     else:
+        user = get_current_user(request, request.GET.get("token", None))
+        if not directory.is_writable_to(user):
+            return HttpResponseForbidden()
+    try:
+        ttl = _get_ttl(directory, request.GET.get("ttl"))
+    except ValueError:
         return HttpResponseBadRequest()
 
+    # The size should be known in advance to reserve it in the quota
+    try:
+        size = int(request.META.get("CONTENT_LENGTH") or "")
+    except ValueError:
+        return HttpResponse(status=411)
+    if size < 0:
+        return HttpResponseBadRequest()
+    if max_size is not None and size > max_size:
+        return HttpResponseForbidden()
+    if not directory.reserve(size):
+        return HttpResponseForbidden()
+
+    tmp_path = None
+    reserved = size
+    try:
+        artifact = Artifact(
+            directory=directory,
+            is_permanent=BooleanField().to_python(request.GET.get("is_permanent")),
+        )
+        field = artifact.path.field
+        storage = field.storage
+        try:
+            name = field.generate_filename(artifact, name)
+            # Truncate the name like FieldFile.save, or reject it if it
+            # cannot fit
+            name = storage.get_available_name(name, max_length=field.max_length)
+        except SuspiciousFileOperation:
+            return HttpResponseBadRequest()
+        # The name is normalized: the file should stay in the directory
+        base = directory.path.strip("/")
+        folder = os.path.dirname(name)
+        if base and folder != base and not folder.startswith(base + "/"):
+            return HttpResponseBadRequest()
+        final_dir = os.path.dirname(storage.path(name))
+        os.makedirs(final_dir, exist_ok=True)
+
+        # Stream the body into a temporary file next to the final location and
+        # compute the digests on the fly
+        md5, sha256 = hashlib.md5(), hashlib.sha256()
+        received = 0
+        with tempfile.NamedTemporaryFile(
+            dir=final_dir, prefix=".upload-", delete=False
+        ) as tmp:
+            tmp_path = tmp.name
+            while received < size:
+                chunk = request.read(min(PUT_CHUNK_SIZE, size - received))
+                if not chunk:
+                    break
+                md5.update(chunk)
+                sha256.update(chunk)
+                tmp.write(chunk)
+                received += len(chunk)
+        # The client went away before the end of the body
+        if received != size:
+            return HttpResponseBadRequest()
+        if storage.file_permissions_mode is not None:
+            os.chmod(tmp_path, storage.file_permissions_mode)
+
+        # Move the file into place. Linking never overwrites an existing file,
+        # even when two uploads pick the same name at the same time.
+        while True:
+            try:
+                name = storage.get_available_name(name, max_length=field.max_length)
+            except SuspiciousFileOperation:
+                return HttpResponseBadRequest()
+            try:
+                os.link(tmp_path, storage.path(name))
+                break
+            except FileExistsError:
+                continue
+
+        artifact.path.name = name
+        artifact.md5 = md5.hexdigest()
+        artifact.sha256 = sha256.hexdigest()
+        artifact.size = size
+        artifact.stored_at = timezone.now()
+        if ttl is not None:
+            artifact.expires_at = directory.get_expiration(ttl)
+        try:
+            _save_artifact(artifact, reserved)
+        except Exception:
+            os.unlink(storage.path(name))
+            raise
+        reserved = 0
+    finally:
+        if tmp_path is not None:
+            os.unlink(tmp_path)
+        if reserved:
+            directory.release(reserved)
+
+    response = _artifact_url(request, artifact)
+    response.status_code = 201
+    return response
+
+
+def _get_ttl(directory, value):
+    # The TTL of an upload (in days) can only be shorter than the TTL of the
+    # directory
+    if not value:
+        return None
+    ttl = int(value)
+    if ttl <= 0 or 0 < directory.ttl < ttl:
+        raise ValueError("Invalid TTL")
+    return ttl
+
+
+def _save_artifact(artifact, reserved):
+    # Update the directory usage and release the reservation in the same
+    # transaction
+    with transaction.atomic():
+        artifact.save()
+        artifact.directory.release(reserved)
+
+
+def _artifact_url(request, artifact):
+    # TODO: does not work with alternate storage
+    return HttpResponse(
+        request.build_absolute_uri(reverse("artifacts", args=[artifact.path.url])),
+        content_type="text/plain",
+    )
+
 
 @csrf_exempt
 def artifacts(request, filename=""):
@@ -255,22 +684,24 @@ def artifacts(request, filename=""):
         return _head(request, filename)
     elif request.method == "POST":
         return _post(request, filename)
+    elif request.method == "PUT":
+        return _put(request, filename)
     elif request.method == "DELETE":
         return _delete(request, filename)
     else:
-        return HttpResponseNotAllowed(["DELETE", "GET", "HEAD", "POST"])
+        return HttpResponseNotAllowed(["DELETE", "GET", "HEAD", "POST", "PUT"])
 
 
 def directories(request):
     user = get_current_user(request, request.GET.get("token", ""))
+    resolver = get_resolver(request, user)
     dirs_query = (
-        Directory.objects.all()
+        Directory.objects.filter(resolver.visible_q(), is_deleting=False)
         .order_by("path")
         .select_related("user", "group")
-        .prefetch_related("artifact_set")
     )
 
-    dirs = [(d, d.is_writable_to(user)) for d in dirs_query if d.is_visible_to(user)]
+    dirs = [(d, resolver.is_writable(d)) for d in dirs_query]
     return render(
         request, "Artifactorial/directories/index.html", {"directories": dirs}
     )
@@ -283,7 +714,9 @@ def shares_root(request):
         # Grab the requested file and check permissions
         put = QueryDict(request.body)
         filename = put.get("path", "")
-        artifact = get_object_or_404(Artifact, path=filename.lstrip("/"))
+        artifact = get_object_or_404(
+            Artifact, path=filename.lstrip("/"), directory__is_deleting=False
+        )
 
         # Get the current user
         user = get_current_user(request, put.get("token", ""))
@@ -309,18 +742,10 @@ def shares_root(request):
 
 def shares(request, token):
     if request.method == "GET":
-        share = get_object_or_404(Share, token=token)
-        artifact = share.artifact
-
-        # Guess the mimetype
-        mime = mimetypes.guess_type(artifact.path.name)
-        response = FileResponse(
-            open(artifact.path.path, "rb"),
-            content_type=mime[0] if mime[0] else "text/plain",
+        share = get_object_or_404(
+            Share, token=token, artifact__directory__is_deleting=False
         )
-
-        response["Content-Length"] = artifact.path.size
-        return response
+        return downloads.serve(request, share.artifact)
 
     elif request.method == "DELETE":
         # Get the current user
@@ -340,6 +765,71 @@ def shares(request, token):
         return HttpResponseNotAllowed(["DELETE", "PUT"])
 
 
+@csrf_exempt
+def signed_root(request):
+    # Create a new signed URL
+    if request.method == "PUT":
+        put = QueryDict(request.body)
+        user = get_current_user(request, put.get("token", ""))
+
+        # Validity of the URL, in seconds
+        max_ttl = getattr(
+            settings, "ARTIFACTORIAL_SIGNED_URL_MAX_TTL", 7 * 24 * 60 * 60
+        )
+        try:
+            ttl = int(put["ttl"]) if "ttl" in put else None
+            max_size = int(put["max_size"]) if "max_size" in put else None
+        except ValueError:
+            return HttpResponseBadRequest()
+        if ttl is not None and not 0 < ttl <= max_ttl:
+            return HttpResponseBadRequest()
+        if max_size is not None and max_size < 0:
+            return HttpResponseBadRequest()
+
+        # Upload URL: the user should have the right to write in the directory
+        if "directory" in put:
+            directory = get_object_or_404(
+                Directory, path="/" + put["directory"].strip("/"), is_deleting=False
+            )
+            if not directory.is_writable_to(user):
+                return HttpResponseForbidden()
+            url = signing.get_upload_url(request, directory.path, max_size, ttl)
+            return HttpResponse(url, content_type="text/plain")
+
+        # Download URL: the user should have the right to read the artifact
+        filename = put.get("path", "")
+        artifact = get_object_or_404(
+            Artifact, path=filename.lstrip("/"), directory__is_deleting=False
+        )
+        if not artifact.is_visible_to(user):
+            return HttpResponseForbidden()
+
+        return HttpResponse(
+            signing.get_signed_url(request, artifact.path.name, ttl),
+            content_type="text/plain",
+        )
+    else:
+        return HttpResponseNotAllowed(["PUT"])
+
+
+def signed(request, filename):
+    if request.method not in ["GET", "HEAD"]:
+        return HttpResponseNotAllowed(["GET", "HEAD"])
+
+    # The signature grants the access: no need to look at the database
+    expires = signing.verify(
+        filename, request.GET.get("exp", None), request.GET.get("sig", None)
+    )
+    if expires is None:
+        return HttpResponseForbidden()
+    artifact = Artifact(path=filename)
+    if not os.path.isfile(artifact.path.path):
+        raise Http404
+    return downloads.serve(
+        request, artifact, max_age=max(int(expires - time.time()), 0)
+    )
+
+
 @login_required
 def tokens(request):
     if request.method == "POST":
@@ -49,6 +49,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "Artifactorial.authentication.TokenAuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -81,9 +82,29 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
+        # Use a file (and not a shared in-memory database) so concurrent
+        # tests wait for the locks instead of failing
+        "TEST": {"NAME": os.path.join(BASE_DIR, "test.sqlite3")},
     }
 }
 
+# Run the tests against PostgreSQL when POSTGRES_HOST is set
+if "POSTGRES_HOST" in os.environ:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "HOST": os.environ["POSTGRES_HOST"],
+            "NAME": os.environ.get("POSTGRES_DB", "artifactorial"),
+            "USER": os.environ.get("POSTGRES_USER", "artifactorial"),
+            "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+        }
+    }
+
+
+# The database is rolled back after each test, without sending the signals
+# that invalidate the cached tokens
+ARTIFACTORIAL_TOKEN_CACHE_TTL = 0
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators